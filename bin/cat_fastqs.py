@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import gzip
+import shutil
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import read_stats
+
+logger = logging.getLogger()
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--fastq_dir", help="Directory with one barcode* directory of fastq files per barcode", type=str, required=True)
+    parser.add_argument("-t", "--threads", help="Number of threads, shared between barcodes processed concurrently [1]", type=int, default=1)
+    parser.add_argument("-m", "--manifest", help="Output TSV with the read count, base count and N50 of every barcode [cat_manifest.tsv]", type=str, default="cat_manifest.tsv")
+    parser.add_argument("--compresslevel", help="Gzip compression level of uncompressed input [1]", type=int, default=1)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def count_lines(lines, lengths):
+    """
+    Count the read lengths of a fastq stream into the lengths Counter.
+    """
+    for i, line in enumerate(lines):
+        if i % 4 == 1:
+            lengths[len(line.rstrip(b"\r\n"))] += 1
+
+def count_gzipped(paths, counts):
+    """
+    Count the read lengths of the gzipped files, decompressed by pigz when available.
+    """
+    if shutil.which("pigz"):
+        pigz = subprocess.Popen(["pigz", "-dc"] + paths, stdout=subprocess.PIPE)
+        count_lines(pigz.stdout, counts["lengths"])
+        pigz.stdout.close()
+        if pigz.wait() != 0:
+            raise subprocess.CalledProcessError(pigz.returncode, "pigz")
+        return counts
+
+    for path in paths:
+        with gzip.open(path, "rb") as f:
+            count_lines(f, counts["lengths"])
+    return counts
+
+def cat_gzipped(paths, output):
+    """
+    Concatenate gzipped files as they are and count their reads.
+    """
+    with open(output, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out)
+    return count_gzipped(paths, read_stats.new_counts())
+
+def cat_plain(paths, output, threads, compresslevel):
+    """
+    Compress the concatenated plain fastq files, with pigz when available, and count their reads.
+    """
+    counts = read_stats.new_counts()
+    lengths = counts["lengths"]
+    with open(output, "wb") as out:
+        if shutil.which("pigz"):
+            pigz = subprocess.Popen(["pigz", "-c", "-p", str(threads), "-{}".format(compresslevel)], stdin=subprocess.PIPE, stdout=out)
+            compressed = pigz.stdin
+        else:
+            pigz = None
+            compressed = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=compresslevel)
+
+        for path in paths:
+            with open(path, "rb") as f:
+                for i, line in enumerate(f):
+                    compressed.write(line)
+                    if i % 4 == 1:
+                        lengths[len(line.rstrip(b"\r\n"))] += 1
+
+        compressed.close()
+        if pigz is not None and pigz.wait() != 0:
+            raise subprocess.CalledProcessError(pigz.returncode, "pigz")
+    return counts
+
+def cat_barcode(barcode_dir, threads, compresslevel):
+    """
+    Write <barcode>.fastq.gz from the gzipped fastq files of the barcode
+    directory or, if there are none, from its plain fastq files.
+    Returns the read length counts, or None if the directory has no fastq files.
+    """
+    barcode = os.path.basename(os.path.normpath(barcode_dir))
+    output = barcode + ".fastq.gz"
+
+    gzipped = sorted(glob.glob(os.path.join(barcode_dir, "*.fastq.gz")))
+    plain = sorted(glob.glob(os.path.join(barcode_dir, "*.fastq")))
+    if gzipped:
+        return barcode, cat_gzipped(gzipped, output)
+    elif plain:
+        return barcode, cat_plain(plain, output, threads, compresslevel)
+    return barcode, None
+
+def main(args):
+    barcode_dirs = sorted(path for path in glob.glob(os.path.join(args.fastq_dir, "barcode*")) if os.path.isdir(path))
+    jobs = max(1, min(args.threads, len(barcode_dirs)))
+    threads = max(1, args.threads // jobs)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(cat_barcode, barcode_dirs, [threads] * len(barcode_dirs), [args.compresslevel] * len(barcode_dirs)))
+
+    with open(args.manifest, "w") as out:
+        out.write("barcode\treads\tbases\tn50\n")
+        for barcode, counts in results:
+            if counts is None:
+                continue
+            stats = read_stats.summarise(counts)
+            logger.info("{}: {} reads".format(barcode, stats["reads"]))
+            out.write("{}\t{}\t{}\t{}\n".format(barcode, stats["reads"], stats["bases"], stats["n50"]))
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
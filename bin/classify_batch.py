@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import re
+import argparse
+import logging
+
+logger = logging.getLogger()
+
+# Leading number as read by sort -n
+NUMBER = re.compile(r"\s*(-?\d*\.?\d*)")
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    concat = subparsers.add_parser("concat", help="Concatenate the consensus sequences of all clusters into one FASTA")
+    concat.add_argument("--clusters", help="Cluster ids, one per consensus", type=str, nargs="+", required=True)
+    concat.add_argument("--consensus", help="Consensus FASTA of every cluster", type=str, nargs="+", required=True)
+    concat.add_argument("-o", "--output", help="Output FASTA", type=str, required=True)
+
+    split = subparsers.add_parser("split", help="Split batch classifier outputs into per-cluster classification logs")
+    split.add_argument("--classification", help="Classification mode", choices=["full", "blast", "seqmatch", "kraken2"], required=True)
+    split.add_argument("--clusters", help="Cluster ids, one per log", type=str, nargs="+", required=True)
+    split.add_argument("--logs", help="Polishing log of every cluster", type=str, nargs="+", required=True)
+    split.add_argument("--prefix", help="Prefix of the output files, usually the sample id", type=str, required=True)
+    split.add_argument("--kraken2_report", help="kraken2 --report of the batch", type=str, default=None)
+    split.add_argument("--kraken2_output", help="kraken2 --output of the batch", type=str, default=None)
+    split.add_argument("--seqmatch", help="SequenceMatch seqmatch output of the batch", type=str, default=None)
+    split.add_argument("--seqmatch_accession", help="Accession table joined to the SequenceMatch hits", type=str, default=None)
+    split.add_argument("--blast", help="blastn output of the batch, query id first", type=str, default=None)
+    split.add_argument("--reclassify_on_fail", help="Use SequenceMatch for clusters kraken2 does not classify at species level", action="store_true")
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def seq_id(cluster, n):
+    return "cluster{}_{}".format(cluster, n)
+
+def seq_cluster(seq_id):
+    return seq_id.rsplit("_", 1)[0][len("cluster"):]
+
+def number(text):
+    value = NUMBER.match(text).group(1)
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+def collapse(text):
+    """
+    Words of text joined by single spaces, as printed by echo $text.
+    """
+    return " ".join(text.split())
+
+def concat_consensus(clusters, consensus, output):
+    """
+    Write every consensus sequence under an id that records its cluster.
+    """
+    with open(output, "w") as out:
+        for cluster, fasta in zip(clusters, consensus):
+            n = 0
+            with open(fasta) as f:
+                for line in f:
+                    if line.startswith(">"):
+                        n += 1
+                        line = ">{}\n".format(seq_id(cluster, n))
+                    out.write(line)
+
+def group_by_cluster(lines, sep):
+    """
+    Lines of a classifier output grouped by the cluster of their query id,
+    with the query id removed.
+    """
+    groups = {}
+    for line in lines:
+        query, rest = line.split(sep, 1)
+        groups.setdefault(seq_cluster(query), []).append(rest)
+    return groups
+
+def read_lines(path):
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+def kraken2_results(report, output):
+    """
+    Return the KR_OUT line and class level of every cluster. A cluster gets the
+    report lines of the taxa its sequences were assigned to, in report order,
+    as `name;taxid;rank`.
+    """
+    taxa = {}
+    for order, line in enumerate(read_lines(report)):
+        fields = line.replace("\t", ";")
+        fields = re.sub(" +", " ", fields).replace("; ", ";").split(";")
+        rank, taxid, name = fields[3], fields[4], fields[5]
+        taxa[taxid] = (order, "{};{};{}".format(name, taxid, rank), rank)
+
+    assigned = {}
+    for line in read_lines(output):
+        fields = line.split("\t")
+        assigned.setdefault(seq_cluster(fields[1]), set()).add(fields[2])
+
+    results = {}
+    for cluster, taxids in assigned.items():
+        lines = sorted(taxa[taxid] for taxid in taxids if taxid in taxa)
+        results[cluster] = ("\n".join(line for order, line, rank in lines), lines[-1][2] if lines else "")
+    return results
+
+def seqmatch_results(seqmatch, accession):
+    """
+    Per-cluster lines of `SequenceMatch | cut -f2,4 | sort | join accession | sort -k3 -n -r`
+    as semicolon separated sciname;taxid;score.
+    """
+    hits = {}
+    for line in read_lines(seqmatch):
+        fields = line.split("\t")
+        hits.setdefault(seq_cluster(fields[0]), []).append((fields[1], fields[3] if len(fields) > 3 else ""))
+
+    wanted = {match for cluster_hits in hits.values() for match, score in cluster_hits}
+    accessions = {}
+    with open(accession) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if fields[0] in wanted:
+                accessions.setdefault(fields[0], []).append(fields)
+
+    results = {}
+    for cluster, cluster_hits in hits.items():
+        lines = []
+        for match, score in cluster_hits:
+            for fields in accessions.get(match, []):
+                sciname = fields[2] if len(fields) > 2 else ""
+                taxid = fields[4] if len(fields) > 4 else ""
+                lines.append("{}\t{}\t{}".format(sciname, taxid, score))
+        lines.sort(key=lambda line: (number(line.split("\t")[2]), line), reverse=True)
+        results[cluster] = [line.replace("\t", ";") for line in lines]
+    return results
+
+def blast_results(blast):
+    """
+    Per-cluster top 5 hits of `blastn | sort -t ',' -k5nr -k6nr | head -n5` as semicolon separated lines.
+    """
+    results = {}
+    for cluster, lines in group_by_cluster(read_lines(blast), ",").items():
+        lines.sort()
+        lines.sort(key=lambda line: (number(line.split(",")[4]), number(line.split(",")[5])), reverse=True)
+        results[cluster] = [line.replace(",", ";") for line in lines[:5]]
+    return results
+
+def write_csv(path, lines):
+    with open(path, "w") as out:
+        out.write("".join(line + "\n" for line in lines))
+
+def split_classification(args):
+    kraken2 = {}
+    if args.kraken2_report:
+        kraken2 = kraken2_results(args.kraken2_report, args.kraken2_output)
+    seqmatch = seqmatch_results(args.seqmatch, args.seqmatch_accession) if args.seqmatch else {}
+    blast = blast_results(args.blast) if args.blast else {}
+
+    for cluster, cluster_log in zip(args.clusters, args.logs):
+        prefix = "{}_{}".format(args.prefix, cluster)
+        kr_out, class_lvl = kraken2.get(cluster, ("", ""))
+        seq_out, blast_out = "", ""
+
+        if args.seqmatch:
+            seq_lines = seqmatch.get(cluster, [])
+            if not seq_lines and args.classification == "full":
+                seq_lines = ["unclassified;0;0"]
+            write_csv(prefix + "_seqmatch_consensus_classification.csv", seq_lines)
+            seq_out = seq_lines[0] if seq_lines else ""
+
+        if args.blast:
+            blast_lines = blast.get(cluster, []) or ["unclassified;0;0"]
+            write_csv(prefix + "_blastn_consensus_classification.csv", blast_lines)
+            fields = blast_lines[0].split(";")
+            blast_out = ";".join(fields[i] for i in (0, 1, 4) if i < len(fields))
+
+        if args.classification == "full":
+            outputs = [kr_out, seq_out, blast_out]
+        elif args.classification == "blast":
+            outputs = [blast_out]
+        elif args.classification == "seqmatch":
+            outputs = [seq_out]
+        elif args.reclassify_on_fail and not class_lvl.startswith("S"):
+            outputs = [seq_out]
+        else:
+            outputs = [kr_out]
+
+        with open(cluster_log) as f:
+            log = f.read()
+        with open(prefix + "_classification.log", "w") as out:
+            out.write(log + ";" + "".join(collapse(output) + "\n" for output in outputs))
+
+def main(args):
+    if args.command == "concat":
+        concat_consensus(args.clusters, args.consensus, args.output)
+    else:
+        split_classification(args)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import pandas as pd
-from functools import reduce
+from functools import reduce, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
 import requests
 import json
 import numpy as np
@@ -13,95 +16,231 @@ logger = logging.getLogger()
 def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--infile", help="Classification results file", type=str)
-    parser.add_argument("--prefix", help="ID of the sample, usually barcode.", type=str)
+    parser.add_argument("--infile", help="Classification results file, one per sample with --run", type=str, nargs="+")
+    parser.add_argument("--prefix", help="ID of the sample, usually barcode, one per infile with --run", type=str, nargs="+")
     parser.add_argument("--outfile", help="Output file name.", type=str, default="rel_abundance")
+    parser.add_argument("--run", help="Also write sample x taxon tables of the whole run.", action="store_true")
+    parser.add_argument("--run_outfile", help="Output file name of the run tables.", type=str, default="run_abundance")
+    parser.add_argument("--taxname_cache", help="SQLite cache of tax names resolved outside the results, reused across runs.", type=str, default=None)
+    parser.add_argument("--taxdump", help="Directory with the NCBI names.dmp and nodes.dmp, used instead of the Unipept API.", type=str, default=None)
+    parser.add_argument("--offline", help="Never query the Unipept API.", action="store_true")
+    parser.add_argument("--api_timeout", help="Timeout of a Unipept API request in seconds.", type=float, default=10)
+    parser.add_argument("--api_batch_size", help="Number of taxids per Unipept API request.", type=int, default=100)
+    parser.add_argument("--api_threads", help="Maximum number of concurrent Unipept API requests.", type=int, default=4)
 
     return parser.parse_args()
 
-def get_taxname(tax_id,tax_level):
+def open_taxname_cache(taxname_cache):
+    cache = sqlite3.connect(taxname_cache)
+    cache.execute("CREATE TABLE IF NOT EXISTS taxname (taxid INTEGER, tax_level TEXT, name TEXT, PRIMARY KEY (taxid, tax_level))")
+    return cache
+
+@lru_cache(maxsize=None)
+def load_taxdump(taxdump):
+    """
+    Return the scientific names and the (parent, rank) of every taxid of an NCBI taxdump.
+    """
+    names = {}
+    with open(os.path.join(taxdump, "names.dmp")) as f:
+        for line in f:
+            fields = line.rstrip("\t|\n").split("\t|\t")
+            if fields[3].startswith("scientific name"):
+                names[int(fields[0])] = fields[1]
+
+    nodes = {}
+    with open(os.path.join(taxdump, "nodes.dmp")) as f:
+        for line in f:
+            fields = line.rstrip("\t|\n").split("\t|\t")
+            nodes[int(fields[0])] = (int(fields[1]), fields[2])
+
+    return names, nodes
+
+def get_taxname_from_taxdump(taxdump, tax_id, tax_level):
+    """
+    Name of the ancestor of tax_id at tax_level, or of the taxon itself if it has
+    none, like the Unipept API. None if tax_id is not in the taxdump.
+    """
+    ranks = {"S": "species","G": "genus","F": "family","O": "order", "C": "class"}
+    names, nodes = load_taxdump(taxdump)
+    if tax_id not in nodes:
+        return None
+
+    node = tax_id
+    while True:
+        parent, rank = nodes[node]
+        if rank == ranks[tax_level]:
+            return names.get(node)
+        if parent == node:
+            return names.get(tax_id)
+        node = parent
+
+def fetch_unipept(tax_ids, timeout):
+    """
+    Unipept taxonomy records of a batch of taxids, keyed by taxid.
+    """
+    response = requests.post('http://api.unipept.ugent.be/api/v1/taxonomy.json',
+                             data={"input[]": tax_ids, "extra": "true", "names": "true"},
+                             timeout=timeout)
+    response.raise_for_status()
+    return {record["taxon_id"]: record for record in json.loads(response.text)}
+
+def get_taxnames_from_unipept(tax_ids, tax_level, timeout=10, batch_size=100, threads=4):
     tags = {"S": "species_name","G": "genus_name","F": "family_name","O":'order_name', "C": "class_name"}
     tax_level_tag = tags[tax_level]
-    #Avoids pipeline crash due to "nan" classification output. Thanks to Qi-Maria from Github
-    if str(tax_id) == "nan":
-        tax_id = 1
-    
-    path = 'http://api.unipept.ugent.be/api/v1/taxonomy.json?input[]=' + str(int(tax_id)) + '&extra=true&names=true'
-    complete_tax = requests.get(path).text
+
+    batches = [tax_ids[i:i+batch_size] for i in range(0, len(tax_ids), batch_size)]
+    records = {}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for batch, future in zip(batches, [pool.submit(fetch_unipept, batch, timeout) for batch in batches]):
+            try:
+                records.update(future.result())
+            except Exception as e:
+                logger.error("Error querying the Unipept API for {} taxids: {}".format(len(batch), e))
 
     #Checks for API correct response (field containing the tax name). Thanks to devinbrown from Github
-    try:
-        name = json.loads(complete_tax)[0][tax_level_tag]
+    names = {}
+    for tax_id, record in records.items():
+        name = record.get(tax_level_tag)
         if name == "":
-            name = json.loads(complete_tax)[0]["taxon_name"]
-    except:
-        logger.error("Error retrieving taxonomic name for tax_id {tax_id} at level {tax_level}.".format(tax_id=tax_id, tax_level=tax_level))
-        name = str(int(tax_id))
-
-    return name
-
-
-def get_taxname_from_dmp(data, tax_id, tax_level):
+            name = record.get("taxon_name")
+        if name:
+            names[tax_id] = name
+    return names
+
+def get_taxnames(tax_ids, tax_level, taxname_cache=None, taxdump=None, offline=False, api_timeout=10, api_batch_size=100, api_threads=4):
+    """
+    Names of tax_ids at tax_level that are missing from the results. Names are
+    taken from the on-disk cache, then the local taxdump, then the Unipept API
+    unless offline, and fall back to the taxid itself.
+    """
+    #Avoids pipeline crash due to "nan" classification output. Thanks to Qi-Maria from Github
+    tax_ids = [1 if str(tax_id) == "nan" else int(tax_id) for tax_id in tax_ids]
+    wanted = sorted(set(tax_ids))
+
+    cache = open_taxname_cache(taxname_cache) if taxname_cache else None
+    names = {}
+    if cache is not None:
+        for i in range(0, len(wanted), 500):
+            batch = wanted[i:i+500]
+            query = "SELECT taxid, name FROM taxname WHERE tax_level = ? AND taxid IN ({})".format(",".join("?" * len(batch)))
+            names.update(cache.execute(query, [tax_level] + batch))
+
+    missing = [tax_id for tax_id in wanted if tax_id not in names]
+    resolved = {}
+    if missing and taxdump:
+        for tax_id in missing:
+            name = get_taxname_from_taxdump(taxdump, tax_id, tax_level)
+            if name:
+                resolved[tax_id] = name
+        missing = [tax_id for tax_id in missing if tax_id not in resolved]
+    if missing and not offline:
+        resolved.update(get_taxnames_from_unipept(missing, tax_level, api_timeout, api_batch_size, api_threads))
+
+    if cache is not None:
+        cache.executemany("INSERT OR REPLACE INTO taxname VALUES (?, ?, ?)", [(tax_id, tax_level, name) for tax_id, name in resolved.items()])
+        cache.commit()
+        cache.close()
+    names.update(resolved)
+
+    for tax_id in wanted:
+        if tax_id not in names:
+            logger.error("Error retrieving taxonomic name for tax_id {tax_id} at level {tax_level}.".format(tax_id=tax_id, tax_level=tax_level))
+            names[tax_id] = str(tax_id)
+
+    return [names[tax_id] for tax_id in tax_ids]
+
+
+def is_string(values):
+    return np.array([isinstance(value, str) for value in values], dtype=bool)
+
+def get_taxnames_from_dmp(data, tax_ids, tax_level):
+    """
+    Resolve the names of all tax_ids at tax_level at once. Every taxid takes the
+    first row of data with that taxid, falling back from the tax level to the
+    name and sciname columns. Returns the names and a mask of the taxids that
+    could not be resolved from data.
+    """
     tags = {"S": "species","G": "genus","F": "family", "O": "order"}
     tax_level_tag = tags[tax_level]
 
-    if str(tax_id) == "nan":
-        name = 'unclassified'
+    lookup = data.drop_duplicates("taxid").set_index("taxid")
+    rows = lookup.reindex(tax_ids)
+    unclassified = pd.isna(tax_ids)
+    failed = (lookup.index.get_indexer(tax_ids) == -1) & ~unclassified
+
+    if tax_level_tag in rows.columns:
+        names = rows[tax_level_tag].to_numpy(dtype=object)
+        for fallback in ["name", "sciname"]:
+            unnamed = ~is_string(names)
+            if fallback not in rows.columns:
+                failed |= unnamed & ~unclassified
+                break
+            names = np.where(unnamed, rows[fallback].to_numpy(dtype=object), names)
     else:
-        name = data.loc[data['taxid'] == tax_id, tax_level_tag].iloc[0]
-        if type(name) != str:
-            name = data.loc[data['taxid'] == tax_id, "name"].iloc[0]
-            if type(name) != str:
-                name = data.loc[data['taxid'] == tax_id, "sciname"].iloc[0]
+        names = np.full(len(tax_ids), np.nan, dtype=object)
+        failed = ~unclassified
 
-    return name
+    names[unclassified] = 'unclassified'
+    return names, failed
 
 
-def get_abundance_values(names,paths):
-    dfs = []
-    for name,path in zip(names,paths):
-        data1 = pd.read_csv(path, index_col=False, sep=';').iloc[:,1:]
+def read_abundance_values(name, path):
+    """
+    Read the classification results of one sample. Returns its (taxid,
+    rel_abundance, reads) rows and the chosen classification of every cluster.
+    """
+    data1 = pd.read_csv(path, index_col=False, sep=';').iloc[:,1:]
+
+    total = data1['reads_in_cluster'].sum(skipna=False)
 
-        total = sum(data1['reads_in_cluster'])
-        rel_abundance=[]
+    data=choose_classification(data1)
 
-        data=choose_classification(data1)
+    rel_abundance = data['reads_in_cluster'] / total * 100
+    data['rel_abundance'] = rel_abundance
+    data.to_csv("" + name + "_nanoclust_out.txt")
 
-        for index,row in data.iterrows():
-            rel_abundance.append(row['reads_in_cluster'] / total * 100)
-            
-        data['rel_abundance'] = rel_abundance
-        dfs.append(pd.DataFrame({'taxid': data['taxid'], 'rel_abundance': rel_abundance, 'reads': data['reads_in_cluster']}))
-        data.to_csv("" + name + "_nanoclust_out.txt")
+    return pd.DataFrame({'taxid': data['taxid'], 'rel_abundance': rel_abundance, 'reads': data['reads_in_cluster']}), data
+
+def get_abundance_values(names,paths):
+    dfs = []
+    for name,path in zip(names,paths):
+        df, data = read_abundance_values(name, path)
+        dfs.append(df)
 
     return dfs, data
 
 def choose_classification(dataframe):
-    print(dataframe)
+    """
+    Pick one classifier per cluster of a full classification table. Species level
+    kraken2 results are kept, otherwise the classifier with the most resolved
+    ranks wins, preferring kraken2, then blast, then seqmatch on ties.
+    """
+    logger.debug(dataframe)
     if len(dataframe.columns)>13:
-        chosen_frame=[]
-        classification_score={}
-        for index, row in dataframe.iterrows():
-            print(row['class_level'])
-            if row['class_level']=="S":
-                chosen_frame.append(row.iloc[:12].tolist())
-            else:
-                classification_score["kraken2"]=sum(row.notna()[8:12])
-                classification_score["blast"]=sum(row.notna()[24:])
-                classification_score["seqmatch"]=sum(row.notna()[16:20])
-                choice=max(classification_score, key=classification_score.get)
-                
-                if choice == "kraken2":
-                    chosen_frame.append(row.iloc[:12].tolist())
-                elif choice == "seqmatch":
-                    chosen_frame.append(row.iloc[np.r_[0:4,13:20]].tolist())
-                else:
-                    chosen_frame.append(row.iloc[np.r_[0:4,20:28]].tolist())
-            
+        kraken2_score = dataframe.iloc[:, 8:12].notna().sum(axis=1).to_numpy()
+        blast_score = dataframe.iloc[:, 24:].notna().sum(axis=1).to_numpy()
+        seqmatch_score = dataframe.iloc[:, 16:20].notna().sum(axis=1).to_numpy()
+
+        kraken2 = (dataframe['class_level'] == "S").to_numpy() | ((kraken2_score >= blast_score) & (kraken2_score >= seqmatch_score))
+        blast = ~kraken2 & (blast_score >= seqmatch_score)
+        choice = np.select([kraken2, blast], ["kraken2", "blast"], default="seqmatch")
+
+        # Columns taken from each classifier block, seqmatch leaves the last one empty
+        blocks = { "kraken2":  np.r_[0:12],      \
+                   "seqmatch": np.r_[0:4,13:20], \
+                   "blast":    np.r_[0:4,20:28] }
+
+        columns = ['reads_in_cluster', 'used_for_consensus', 'reads_after_corr', 'draft_id', 'classifier_name', 'taxid', 'stat', 'name', 'species', 'genus', 'family', 'order']
+        values = dataframe.to_numpy(dtype=object)
+        chosen = np.full((len(dataframe), len(columns)), None, dtype=object)
+        for classifier, block in blocks.items():
+            rows = choice == classifier
+            if rows.any():
+                chosen[np.ix_(rows, np.arange(len(block)))] = values[np.ix_(rows, block)]
+
         logger.info("Choosing classification")
-        logger.debug(chosen_frame)
 
-        chosen_df=pd.DataFrame(chosen_frame, columns=['reads_in_cluster', 'used_for_consensus', 'reads_after_corr', 'draft_id', 'classifier_name', 'taxid', 'stat', 'name', 'species', 'genus', 'family', 'order'])
+        chosen_df=pd.DataFrame(chosen, columns=columns).infer_objects()
         logger.debug(len(chosen_df))
         logger.debug(chosen_df)
 
@@ -109,52 +248,114 @@ def choose_classification(dataframe):
     else:
         return dataframe
 
-def merge_abundance(dfs, data, tax_level):
+def get_lineage(df_final, data, tax_levels, **taxname_options):
+    """
+    Names of the taxid of every row of df_final at each tax level, one column per level.
+    """
+    tax_ids = df_final["taxid"].to_numpy()
+    lineage = {}
+    for tax_level in tax_levels:
+        all_tax, failed = get_taxnames_from_dmp(data, tax_ids, tax_level)
+
+        # Handle collapsing for specific tax IDs at 'S' level
+        if tax_level == "S":
+            complex_ids = df_final["taxid"].isin([1280, 985002, 1654388]).to_numpy()
+            all_tax[complex_ids] = "Staphylococcus aureus complex"
+            failed &= ~complex_ids
+
+        if failed.any():
+            logger.error("Error getting taxonomic names for tax_ids {} in merge_abundance.".format(", ".join(str(tax_id) for tax_id in tax_ids[failed])))
+            all_tax[failed] = get_taxnames(tax_ids[failed], tax_level, **taxname_options)
+
+        lineage[tax_level] = all_tax
+
+    return pd.DataFrame(lineage, index=df_final.index)
+
+def merge_abundance(dfs, data, tax_levels, **taxname_options):
+    """
+    Sum the abundances of every tax level in one groupby over a long
+    (tax_level, taxid name) frame. Returns the sorted table of each level.
+    """
     df_final = reduce(lambda left, right: pd.merge(left, right, on='taxid', how='outer').fillna(0), dfs)
-    all_tax = []
+    lineage = get_lineage(df_final, data, tax_levels, **taxname_options)
 
-    for index, row in df_final.iterrows():
-        try:
-            # Handle collapsing for specific tax IDs at 'S' level
-            if tax_level == "S" and row["taxid"] in [1280, 985002, 1654388]:
-                all_tax.append("Staphylococcus aureus complex")
-            else:
-                all_tax.append(get_taxname_from_dmp(data, row["taxid"], tax_level))
-        except:
-            logger.error("Error getting taxonomic name for tax_id {} in merge_abundance.".format(row["taxid"]))
-            if tax_level == "S" and row["taxid"] in [1280, 985002, 1654388]:
-                all_tax.append("Staphylococcus aureus complex")
-            else:
-                all_tax.append(get_taxname(row["taxid"], tax_level))
+    # Group by level and taxid and sum the abundance values
+    df_long = lineage.melt(var_name="tax_level", value_name="taxid", ignore_index=False).join(df_final.drop(columns="taxid"))
+    df_long_grp = df_long.groupby(["tax_level", "taxid"], as_index=False).sum()
 
-    df_final["taxid"] = all_tax
+    tables = {}
+    for tax_level in tax_levels:
+        df_final_grp = df_long_grp[df_long_grp["tax_level"] == tax_level].drop(columns="tax_level").reset_index(drop=True)
+        tables[tax_level] = df_final_grp.sort_values(by='rel_abundance', ascending=False)
 
-    # Collapse entries labeled as 'Staphylococcus aureus complex'
-    if tax_level == "S":
-        df_final.loc[df_final["taxid"] == "Staphylococcus aureus complex", "taxid"] = "Staphylococcus aureus complex"
+    return tables
 
-    # Group by taxid and sum the abundance values
-    df_final_grp = df_final.groupby(["taxid"], as_index=False).sum()
-    df_final_sorted = df_final_grp.sort_values(by='rel_abundance', ascending=False)
 
-    return df_final_sorted
 
-
-
-def get_abundance(names,paths,tax_level, outfile):
+def get_abundance(names,paths,tax_levels, outfile, **taxname_options):
     if(not isinstance(paths, list)):
         paths = [paths]
         names = [names]
 
     dfs, data = get_abundance_values(names,paths)
-    df_final_grp = merge_abundance(dfs, data, tax_level)
-    df_final_grp.to_csv(outfile + "_"+ names[0] + "_" + tax_level + ".csv", index = False)
+    tables = merge_abundance(dfs, data, tax_levels, **taxname_options)
+    for tax_level in tax_levels:
+        tables[tax_level].to_csv(outfile + "_"+ names[0] + "_" + tax_level + ".csv", index = False)
+
+    return tables
+
+def get_run_abundance(names, paths, tax_levels, outfile, run_outfile, **taxname_options):
+    """
+    Write the abundance tables of every sample, then a taxon x sample table of
+    reads and of relative abundance per tax level. The names of all samples are
+    resolved at once and every level is counted in a single bincount over the
+    (taxon, sample) codes of the long rows, the per-sample tables and the
+    relative abundances are read off that count matrix.
+    """
+    samples = [read_abundance_values(name, path) for name, path in zip(names, paths)]
+    run_long = pd.concat([df.assign(sample=name) for name, (df, data) in zip(names, samples)], ignore_index=True)
+    data = pd.concat([data for df, data in samples], ignore_index=True)
+    totals = np.array([df['reads'].sum(skipna=False) for df, data in samples], dtype=np.float64)
+
+    lineage = get_lineage(run_long, data, tax_levels, **taxname_options)
+    sample_codes = pd.Categorical(run_long["sample"], categories=names).codes
+    reads = run_long["reads"].to_numpy(dtype=np.float64)
+
+    for tax_level in tax_levels:
+        taxa = pd.Categorical(lineage[tax_level])
+        named = taxa.codes >= 0
+        cells = taxa.codes[named].astype(np.int64) * len(names) + sample_codes[named]
+        size = len(taxa.categories) * len(names)
+        counts = np.bincount(cells, weights=reads[named], minlength=size).reshape(-1, len(names))
+        present = np.bincount(cells, minlength=size).reshape(-1, len(names)) > 0
+        rel_abundance = counts / totals * 100
+
+        for j, name in enumerate(names):
+            rows = present[:, j]
+            table = pd.DataFrame({ "taxid":         taxa.categories[rows],     \
+                                   "rel_abundance": rel_abundance[rows, j],    \
+                                   "reads":         counts[rows, j] })
+            table = table.astype({"reads": run_long["reads"].dtype})
+            table.sort_values(by='rel_abundance', ascending=False).to_csv(outfile + "_"+ name + "_" + tax_level + ".csv", index = False)
+
+        order = np.argsort(-counts.sum(axis=1), kind="stable")
+        index = pd.Index(taxa.categories[order], name="taxid")
+        pd.DataFrame(counts[order], index=index, columns=names).astype(run_long["reads"].dtype).to_csv(run_outfile + "_" + tax_level + "_reads.csv")
+        pd.DataFrame(rel_abundance[order], index=index, columns=names).to_csv(run_outfile + "_" + tax_level + "_rel_abundance.csv")
 
 
 def main(args):
-
-    for level in ["G", "S", "O", "F"]:
-        get_abundance(args.prefix, args.infile, level, args.outfile)
+    taxname_options = { "taxname_cache":  args.taxname_cache,  \
+                        "taxdump":        args.taxdump,        \
+                        "offline":        args.offline,        \
+                        "api_timeout":    args.api_timeout,    \
+                        "api_batch_size": args.api_batch_size, \
+                        "api_threads":    args.api_threads }
+
+    if args.run:
+        get_run_abundance(args.prefix, args.infile, ["G", "S", "O", "F"], args.outfile, args.run_outfile, **taxname_options)
+    else:
+        get_abundance(args.prefix, args.infile, ["G", "S", "O", "F"], args.outfile, **taxname_options)
 
 if __name__=="__main__":
     args = parse_args()
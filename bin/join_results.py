@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sqlite3
+import tempfile
+import argparse
+import logging
+
+logger = logging.getLogger()
+
+HEADERS = {
+    "full": "id;reads_in_cluster;used_for_consensus;reads_after_corr;draft_id;kraken2_sciname;taxid;class_level;name;species;genus;family;order;seqmatch_sciname;taxid;class_level;name;species;genus;family;order;blast_sciname;taxid;class_level;name;species;genus;family;order;",
+    "blast": "id;reads_in_cluster;used_for_consensus;reads_after_corr;draft_id;sciname;taxid;length;per_ident",
+    "seqmatch": "id;reads_in_cluster;used_for_consensus;reads_after_corr;draft_id;sciname;taxid;seqmatch_score;name;species;genus;family;order",
+    "kraken2": "id;reads_in_cluster;used_for_consensus;reads_after_corr;draft_id;sciname;taxid;class_level;name;species;genus;family;order",
+}
+
+# Leading run of grep word constituents (letters, digits and underscore)
+LEADING_WORD = re.compile(r"[A-Za-z0-9_]*")
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-c", "--classification", help="Classification mode of the logs", choices=["full", "blast", "seqmatch", "kraken2"], required=True)
+    parser.add_argument("-t", "--taxonomy", help="Taxonomy dump with the taxid in the first column, e.g. rankedlineage.dmp", type=str, default=None)
+    parser.add_argument("-i", "--index", help="SQLite taxid index of the taxonomy dump, built from --taxonomy if missing [None]", type=str, default=None)
+    parser.add_argument("-o", "--output", help="Output file [nanoclust_out.txt]", type=str, default="nanoclust_out.txt")
+    parser.add_argument("logs", help="Classification logs of the clusters", nargs="+")
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def read_text(path):
+    with open(path, encoding="utf-8", errors="surrogateescape", newline="") as f:
+        return f.read()
+
+def read_dump_lines(path):
+    """
+    Lines of the taxonomy dump read one at a time, a last line without newline dropped.
+    """
+    with open(path, encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+        for line in f:
+            if line.endswith("\n"):
+                yield line[:-1]
+
+def leading_word(text):
+    return LEADING_WORD.match(text).group(0)
+
+def word_match(line, taxid):
+    """
+    Whether grep -w "^taxid" matches line.
+    """
+    return line.startswith(taxid) and (len(line) == len(taxid) or not LEADING_WORD.match(line[len(taxid)]).group(0))
+
+def read_lines(text):
+    """
+    Split text into lines the way `while read line` does: backslash escapes are
+    removed, surrounding blanks stripped and a last line without newline dropped.
+    """
+    lines = []
+    pending = ""
+    for line in text.split("\n")[:-1]:
+        line = pending + line
+        if (len(line) - len(line.rstrip("\\"))) % 2 == 1:
+            pending = line[:-1]
+            continue
+        pending = ""
+        lines.append(re.sub(r"\\(.)", r"\1", line.strip(" \t")))
+    return lines
+
+def collapse(line):
+    """
+    Words of line joined by single spaces, as printed by echo $line.
+    """
+    return " ".join(word for word in re.split(r"[ \t\n]+", line) if word)
+
+def full_taxid(record):
+    fields = record.split(";")
+    return fields[-2] if len(fields) > 1 else record
+
+def cut_taxid(text):
+    values = []
+    for line in text.split("\n")[:-1] if text.endswith("\n") else text.split("\n"):
+        fields = line.split(";")
+        values.append(fields[6] if len(fields) >= 7 else "" if len(fields) > 1 else line)
+    return "\n".join(values).rstrip("\n")
+
+class TaxonomyIndex:
+    """
+    Lookup of taxonomy dump lines by taxid, either the lines of the requested
+    taxids read in a single pass over the dump or a prebuilt SQLite index.
+    """
+    def __init__(self, taxonomy, index, taxids):
+        self.lines = None
+        self.db = None
+        if index:
+            if not os.path.exists(index):
+                build_index(taxonomy, index)
+            self.db = sqlite3.connect(index)
+        elif taxonomy:
+            keys = {leading_word(taxid) for taxid in taxids}
+            self.lines = {}
+            for line in read_dump_lines(taxonomy):
+                key = leading_word(line)
+                if key in keys:
+                    self.lines.setdefault(key, []).append(line)
+
+    def lookup(self, taxid):
+        """
+        Return the dump lines matched by grep -w "^taxid".
+        """
+        key = leading_word(taxid)
+        if self.db is not None:
+            lines = [line for line, in self.db.execute("SELECT line FROM lineage WHERE key = ? ORDER BY rowid", (key,))]
+        elif self.lines is not None:
+            lines = self.lines.get(key, [])
+        else:
+            lines = []
+        return [line for line in lines if word_match(line, taxid)]
+
+def build_index(taxonomy, index):
+    logger.info("Building taxonomy index {} from {}".format(index, taxonomy))
+    # Tasks building the index at the same time each write their own file, the last one replaces the others
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(index) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(index)))
+    os.close(fd)
+    try:
+        db = sqlite3.connect(tmp)
+        db.execute("CREATE TABLE lineage (key TEXT, line TEXT)")
+        db.executemany("INSERT INTO lineage VALUES (?, ?)", ((leading_word(line), line) for line in read_dump_lines(taxonomy)))
+        db.execute("CREATE INDEX lineage_key ON lineage (key)")
+        db.commit()
+        db.close()
+        os.replace(tmp, index)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def format_taxonomy(lines):
+    """
+    Name and ranks of the matched lines, as tr -d '\\t' | cut -d '|' -f2,3,4,5,6 --output-delimiter ';'.
+    """
+    ranks = []
+    for line in lines:
+        fields = line.replace("\t", "").split("|")
+        ranks.append(";".join(fields[1:6]) if len(fields) > 1 else fields[0])
+    return "\n".join(ranks).rstrip("\n")
+
+def in_taxonomy(lines):
+    return "\n".join(lines).rstrip("\n") != ""
+
+def join_full(logs, index):
+    out = []
+    for text in logs:
+        for line in read_lines(text):
+            record = collapse(line)
+            lines = index.lookup(full_taxid(record))
+            out.append(record)
+            if in_taxonomy(lines):
+                out.append(";" + format_taxonomy(lines) + ";")
+            else:
+                out.append(";;;;;;")
+        out.append("\n\n")
+    return "".join(out)
+
+def join_lineage(logs, index):
+    out = []
+    for text in logs:
+        lines = []
+        for taxid in cut_taxid(text).split("\n"):
+            lines.extend(index.lookup(taxid))
+        out.append(text.replace("\n", ""))
+        if in_taxonomy(lines):
+            out.append(";" + format_taxonomy(lines) + "\n")
+        else:
+            out.append(";;;;\n")
+    return "".join(out)
+
+def main(args):
+    logs = [read_text(log) for log in args.logs]
+
+    if args.classification == "full":
+        taxids = [full_taxid(collapse(line)) for text in logs for line in read_lines(text)]
+    elif args.classification == "blast":
+        taxids = []
+    else:
+        taxids = [taxid for text in logs for taxid in cut_taxid(text).split("\n")]
+    index = TaxonomyIndex(args.taxonomy, args.index, taxids) if args.classification != "blast" else None
+
+    if args.classification == "full":
+        result = HEADERS["full"] + "\n" + join_full(logs, index)
+        # The last character of every line is the trailing ';' of a record
+        result = "\n".join(line[:-1] for line in result.split("\n"))
+    elif args.classification == "blast":
+        result = HEADERS["blast"] + "\n" + "".join(logs)
+    else:
+        result = HEADERS[args.classification] + "\n" + join_lineage(logs, index)
+
+    with open(args.output, "w", encoding="utf-8", errors="surrogateescape", newline="") as out:
+        out.write(result)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
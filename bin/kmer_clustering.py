@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+import argparse
+import logging
+
+import kmer_freq
+import umap_hdbscan
+
+logger = logging.getLogger()
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    # K-mer counting arguments, see kmer_freq.py
+    parser.add_argument("-k", help="k-mer size [5]", type=int, default=5)
+    parser.add_argument('-r', action='store', dest='qced_reads', help='READS')
+    parser.add_argument('-z', "--zipped", help="Input file is gzipped [False]", action="store_true")
+    parser.add_argument("-t", "--threads", help="Number of threads to use [4]", type=int, default=4)
+    parser.add_argument("--backend", help="K-mer counting backend [numpy]", choices=["python", "numpy"], default="numpy")
+    parser.add_argument("-b", "--batch_size", help="Number of reads handed to the worker pool at a time [5000]", type=int, default=5000)
+    parser.add_argument("--max_reads", help="Number of rows preallocated for the k-mer matrix, grown if exceeded [100000]", type=int, default=100000)
+
+    # Clustering arguments, see umap_hdbscan.py
+    parser.add_argument("--umap_n_neighbors", help="The size of the local neighborhood UMAP will look at when attempting to learn the manifold structure of the data [15]", type=int, default=15)
+    parser.add_argument("--umap_min_dist", help="The minimum distance apart that points are allowed to be in the low dimensional representation. [0.1]", type=float, default=0.1)
+    parser.add_argument("--umap_pre_reduce", help="Reduce the k-mer matrix with PCA or randomized SVD before UMAP [none]", choices=["none", "pca", "svd"], default="none")
+    parser.add_argument("--umap_pre_dims", help="Number of dimensions kept by the pre-reduction [50]", type=int, default=50)
+    parser.add_argument("--umap_nn_trees", help="Number of random projection trees of the NN-descent kNN search, precomputes the kNN graph [None]", type=int, default=None)
+    parser.add_argument("--umap_nn_iters", help="Number of NN-descent iterations, precomputes the kNN graph [None]", type=int, default=None)
+    parser.add_argument("--umap_high_memory", help="Use the faster, high memory NN-descent of UMAP and pynndescent instead of their low memory default [False]", action="store_true")
+    parser.add_argument("--umap_knn", help="File of a precomputed kNN graph passed to UMAP, computed and written if missing [None]", type=str, default=None)
+    parser.add_argument("--min_samples", help="Measure of how conservative the clustering should be. [None]", type=str, default="n")
+    parser.add_argument("--min_cluster_size", help="Minimum number of reads to call a independent cluster [50]", type=int, default=50)
+    parser.add_argument("--cluster_sel_epsilon", help="Minimun distance to separate clusters. [0.5]", type=float, default=0.5)
+    parser.add_argument("--sweep_epsilon", help="Also write the clusterings of these cluster selection epsilons, extracted from the same HDBSCAN tree [None]", type=float, nargs="+", default=None)
+    parser.add_argument("--sweep_min_cluster_size", help="Also write the clusterings of these minimum cluster sizes, extracted from the same HDBSCAN tree [None]", type=int, nargs="+", default=None)
+    parser.add_argument("--outfile", help="Output file name [*hdbscan.output]", type=str, default="hdbscan.output")
+    parser.add_argument("--model_cache", help="Directory of fitted UMAP/HDBSCAN models reused across samples of the same assay, k and hyperparameters [None]", type=str, default=None)
+    parser.add_argument("--assay", help="Assay of the sample, part of the model cache key [default]", type=str, default="default")
+    parser.add_argument("--model_cache_size", help="Maximum size of the model cache in MB, least recently used models are evicted first [2048]", type=int, default=2048)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def build_kmer_matrix(args):
+    """
+    Stream the k-mer vectors of all reads into a preallocated float32 matrix.
+    Returns the read ids/lengths and the filled rows of the matrix.
+    """
+    ftype          = kmer_freq.check_input_format(args.qced_reads, args.zipped)
+    combined_kmers = kmer_freq.init_kmer_tables(args.k)
+
+    if args.backend=="numpy":
+        funct = kmer_freq.calc_seq_kmer_freqs_np
+    else:
+        funct = kmer_freq.calc_seq_kmer_freqs
+
+    X        = np.empty((max(1, args.max_reads), len(combined_kmers)), dtype=np.float32)
+    read_ids = []
+    lengths  = []
+    n_reads  = 0
+
+    for results, batch_lengths in kmer_freq.iter_seq_kmers( args.qced_reads,  \
+                                                            ftype,            \
+                                                            args.k,           \
+                                                            args.threads,     \
+                                                            funct,            \
+                                                            False,            \
+                                                            False,            \
+                                                            args.zipped,      \
+                                                            args.batch_size ):
+        n_batch = len(results)
+        if n_reads + n_batch > X.shape[0]:
+            logger.warning("More than {} reads in the input, growing the k-mer matrix.".format(X.shape[0]))
+            grown           = np.empty((max(2 * X.shape[0], n_reads + n_batch), X.shape[1]), dtype=np.float32)
+            grown[:n_reads] = X[:n_reads]
+            X               = grown
+
+        X[n_reads:n_reads+n_batch] = [ comp_vector for read_id, comp_vector in results ]
+        read_ids.extend( read_id.split(" ")[0] for read_id, comp_vector in results )
+        lengths.extend(batch_lengths)
+        n_reads += n_batch
+
+    df = pd.DataFrame({"read": read_ids, "length": lengths})
+    return df, X[:n_reads]
+
+def main(args):
+    df, X = build_kmer_matrix(args)
+    umap_hdbscan.cluster_kmer_freqs(df, X, args)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
+    print("umap finished")
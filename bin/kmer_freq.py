@@ -5,16 +5,31 @@ from Bio import SeqIO
 from Bio.SeqIO.QualityIO import FastqGeneralIterator
 from Bio.SeqIO.FastaIO import SimpleFastaParser
 from collections import Counter,OrderedDict
-from itertools import product,groupby
+from itertools import product,groupby,islice
 import math
 import multiprocessing
+import numpy as np
 from tqdm import tqdm
 import argparse
 import gzip
+import struct
 import logging
 
 logger = logging.getLogger()
 
+# 2-bit encoding of nucleotides, anything other than ACGT is flagged with 4
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("ACGT"):
+    BASE_CODES[ord(base)]         = code
+    BASE_CODES[ord(base.lower())] = code
+
+# Canonical k-mer tables, filled once by init_kmer_tables() in the parent and
+# in every pool worker instead of being shipped with each task
+KMER_TABLES = {}
+
+# Fixed .npy header size, so the row count can be patched in once streaming is done
+NPY_HEADER_LEN = 128
+
 def parse_args():
     # Create argument parser
     parser = argparse.ArgumentParser()
@@ -29,14 +44,19 @@ def parse_args():
     parser.add_argument("-t", "--threads", help="Number of threads to use [4]", type=int, default=4)
     parser.add_argument("-c", "--count", help="Provide raw k-mer raw counts, not normalized [False]", action="store_true", default=False)
     parser.add_argument("-f", "--frac", help="Provide k-mer counts normalized by total number of k-mers [False]", action="store_true", default=False)
+    parser.add_argument("-s", "--stream", help="Parse the input once and stream reads through a persistent worker pool [False]", action="store_true", default=False)
+    parser.add_argument("--backend", help="K-mer counting backend [python]", choices=["python", "numpy"], default="python")
+    parser.add_argument("-b", "--batch_size", help="Number of reads handed to the worker pool at a time [5000]", type=int, default=5000)
+    parser.add_argument("-n", "--n_reads", help="Number of reads of the input, e.g. from the read stats manifest, counted from the input if not given [None]", type=int, default=None)
+    parser.add_argument("--npy", help="Write a float32 matrix to NPY.npy and read ids/lengths to NPY.reads.tsv instead of a TSV to stdout", type=str, default=None)
 
     # Parse arguments
     args = parser.parse_args()
 
     return args
 
-def launch_pool( procs, funct, args ):
-    p    = multiprocessing.Pool(processes=procs)
+def launch_pool( procs, funct, args, k ):
+    p    = multiprocessing.Pool(processes=procs, initializer=init_kmer_tables, initargs=(k,))
     try:
         results = p.map(funct, args)
         p.close()
@@ -52,6 +72,22 @@ def chunks( l, n ):
     for i in range(0, len(l), n):
         yield l[i:i+n]
 
+def open_fastx( fastx, zipped ):
+    if zipped:
+        return gzip.open(fastx, mode="rt")
+    return open(fastx)
+
+def iter_fastx( fast_file, ftype ):
+    """
+    Yield (read_id, seq) tuples from an open fasta/fastq handle.
+    """
+    if ftype=="fastq":
+        for read_id, seq, qual in FastqGeneralIterator(fast_file):
+            yield read_id, seq
+    elif ftype=="fasta":
+        for read_id, seq in SimpleFastaParser(fast_file):
+            yield read_id, seq
+
 def rev_comp_motif( motif ):
     """
     Return the reverse complement of the input motif.
@@ -95,7 +131,7 @@ def combine_kmers_list( all_kmers ):
     combined.sort()
     return combined
 
-def kmer_freq ( seq_str, k, combined_kmers, kmer_names_only=False ):
+def kmer_freq ( seq_str, k, kmer_pairs, kmer_names_only=False ):
     seq_str    = seq_str.upper()
     
     all_kmer_n = Counter()
@@ -105,48 +141,118 @@ def kmer_freq ( seq_str, k, combined_kmers, kmer_names_only=False ):
 
     # Combine forward and reverse complement motifs into one count
     combined_kmer_n = Counter()
-    for kmer in combined_kmers:
-        kmer_rc               = rev_comp_motif(kmer)
+    for kmer,kmer_rc in kmer_pairs:
         combined_kmer_n[kmer] = all_kmer_n[kmer] + all_kmer_n[kmer_rc]
     return combined_kmer_n
 
 def calc_seq_kmer_freqs( tup ):
     read_id        = tup[0]
     seq            = tup[1]
-    k              = tup[2]
-    combined_kmers = tup[3]
-    i              = tup[4]
-    count          = tup[5]
-    frac           = tup[6]
+    i              = tup[2]
+    count          = tup[3]
+    frac           = tup[4]
     
     seq_comp            = []
-    combined_kmer_n     = kmer_freq( seq, k, combined_kmers )
+    combined_kmer_n     = kmer_freq( seq, KMER_TABLES["k"], KMER_TABLES["kmer_pairs"] )
     ord_combined_kmer_n = OrderedDict(sorted(combined_kmer_n.items()))
+    total               = sum(combined_kmer_n.values())
 
     for kmer,n in ord_combined_kmer_n.items():
         if count:
             kmer_comp = n
         elif frac:
-            kmer_comp = float(n) / sum(combined_kmer_n.values())
+            kmer_comp = float(n) / total
         else:
-            kmer_comp = math.log(float(n + 1) / sum(combined_kmer_n.values())) # adding pseudocount for log transform
+            kmer_comp = math.log(float(n + 1) / total) # adding pseudocount for log transform
         seq_comp.append(kmer_comp)
 
     return read_id, seq_comp
 
-def build_args_for_kmer_calc(read_num, target_range, args, read_id, seq, k, combined_kmers, lengths_d, count, frac):
+def build_canonical_index( k, combined_kmers ):
+    """
+    Map every 2-bit encoded k-mer to its column in combined_kmers. Palindromic
+    k-mers are counted on both strands by kmer_freq, so their columns are
+    weighted by 2.
+    """
+    columns = { kmer:i for i,kmer in enumerate(combined_kmers) }
+    index   = np.empty(4**k, dtype=np.int32)
+    weights = np.ones(len(combined_kmers), dtype=np.int64)
+    for code, seq in enumerate(product("ACGT", repeat=k)):
+        kmer    = "".join(seq)
+        kmer_rc = rev_comp_motif(kmer)
+        if kmer in columns:
+            index[code] = columns[kmer]
+        else:
+            index[code] = columns[kmer_rc]
+        if kmer == kmer_rc:
+            weights[columns[kmer]] = 2
+    return index, weights
+
+def init_kmer_tables( k ):
+    """
+    Build the canonical k-mer tables for k once per process. Workers forked
+    after the parent has built them inherit the tables and skip the rebuild.
+    """
+    if KMER_TABLES.get("k") != k:
+        combined_kmers           = combine_kmers_list(build_all_kmers(k))
+        canonical_index, weights = build_canonical_index(k, combined_kmers)
+        KMER_TABLES.update( k=k,                                                                       \
+                            combined_kmers=combined_kmers,                                             \
+                            kmer_pairs=[ (kmer, rev_comp_motif(kmer)) for kmer in combined_kmers ],    \
+                            canonical_index=canonical_index,                                           \
+                            weights=weights )
+    return KMER_TABLES["combined_kmers"]
+
+def kmer_codes( seq_str, k ):
+    """
+    Return the rolling 2-bit codes of all k-mers made only of A, C, G and T.
+    """
+    encoded = BASE_CODES[np.frombuffer(seq_str.encode("ascii"), dtype=np.uint8)]
+    n       = len(encoded) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    codes = np.zeros(n, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    for j in range(k):
+        window = encoded[j:j+n]
+        codes  = (codes << 2) | (window & 3)
+        valid &= window < 4
+    return codes[valid]
+
+def kmer_freq_np( seq_str, k, canonical_index, weights ):
+    counts = np.bincount(canonical_index[kmer_codes(seq_str, k)], minlength=len(weights))
+    return counts * weights
+
+def calc_seq_kmer_freqs_np( tup ):
+    read_id = tup[0]
+    seq     = tup[1]
+    count   = tup[3]
+    frac    = tup[4]
+
+    counts = kmer_freq_np( seq, KMER_TABLES["k"], KMER_TABLES["canonical_index"], KMER_TABLES["weights"] )
+    if count:
+        seq_comp = counts
+    elif frac:
+        seq_comp = counts / counts.sum()
+    else:
+        seq_comp = np.log((counts + 1) / counts.sum()) # adding pseudocount for log transform
+
+    return read_id, seq_comp.tolist()
+
+def build_args_for_kmer_calc(read_num, target_range, args, read_id, seq, lengths_d, count, frac):
     status = "keep going"
     if read_num>=target_range[0] and read_num<=target_range[1]:
 
         # if read_num%1000==0: print("Loading...",target_range, read_num)
 
-        args.append( (read_id, seq, k, combined_kmers, read_num, count, frac) )
+        args.append( (read_id, seq, read_num, count, frac) )
         lengths_d[read_id] = len(seq)
     elif read_num>target_range[1]:
         status = "over"
     return args,status
 
-def launch_seq_kmers_pool( fastx, ftype, k, threads, target_range, combined_kmers, count, frac, zipped ):
+def launch_seq_kmers_pool( fastx, ftype, k, threads, target_range, funct, count, frac, zipped ):
     
     args      = []
     lengths_d = {}
@@ -158,27 +264,30 @@ def launch_seq_kmers_pool( fastx, ftype, k, threads, target_range, combined_kmer
 
     if ftype=="fastq":
         for read_num, (read_id, seq, qual) in enumerate(FastqGeneralIterator(fast_file)):
-            args,status = build_args_for_kmer_calc(read_num, target_range, args, read_id, seq, k, combined_kmers, lengths_d, count, frac)
+            args,status = build_args_for_kmer_calc(read_num, target_range, args, read_id, seq, lengths_d, count, frac)
             if status=="over":
                 break
 
     elif ftype=="fasta":
         for read_num, (read_id, seq) in enumerate(SimpleFastaParser(fast_file)):
-            args,status = build_args_for_kmer_calc(read_num, target_range, args, read_id, seq, k, combined_kmers, lengths_d, count, frac)
+            args,status = build_args_for_kmer_calc(read_num, target_range, args, read_id, seq, lengths_d, count, frac)
             if status=="over":
                 break
     
-    results = launch_pool( threads, calc_seq_kmer_freqs, args )
+    results = launch_pool( threads, funct, args, k )
     
     return dict(results), lengths_d
 
+def format_comp_vector( read_id, length, comp_vector ):
+    comp_vec_str = "\t".join( map(lambda x: str(round(x,4)), comp_vector))
+    return "%s\t%i\t%s" % (read_id.split(" ")[0], length, comp_vec_str)
+
 def print_comp_vectors(read_num, target_range, comp_vectors, read_id, lengths_d):
     status = "keep going"
     if read_num>=target_range[0] and read_num<=target_range[1]:
 
         # if read_num%1000==0: print("writing...",target_range, read_num)
-        comp_vec_str = "\t".join( map(lambda x: str(round(x,4)), comp_vectors[read_id]))
-        print("%s\t%i\t%s" % (read_id.split(" ")[0], lengths_d[read_id], comp_vec_str))
+        print(format_comp_vector(read_id, lengths_d[read_id], comp_vectors[read_id]))
     elif read_num>target_range[1]:
         status = "over"
     return status
@@ -202,39 +311,80 @@ def write_output( fastx, ftype, comp_vectors, lengths_d, target_range, zipped ):
             if status=="over":
                 break
 
-def get_n_reads(fastx, ftype, zipped):
-    n_lines = 0
-    if zipped:
-        with gzip.open(fastx, mode="rt") as f:
-            for i, l in enumerate(f):
-                n_lines += 1
-
-        if ftype=="fastq":
-            n_reads = len([read_tup for read_tup in FastqGeneralIterator(gzip.open(fastx, mode="rt"))])
-        elif ftype=="fasta":
-            n_reads = len([read_tup for read_tup in SimpleFastaParser(gzip.open(fastx, mode="rt"))])
+def write_npy_header( npy_file, n_rows, n_cols ):
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%i, %i), }" % (n_rows, n_cols)
+    header = header.ljust(NPY_HEADER_LEN - 11) + "\n"
+    npy_file.write(np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+def open_npy_output( prefix, n_cols ):
+    npy_file   = open(prefix + ".npy", "wb")
+    reads_file = open(prefix + ".reads.tsv", "w")
+    write_npy_header(npy_file, 0, n_cols)
+    reads_file.write("read\tlength\n")
+    return npy_file, reads_file, n_cols
+
+def close_npy_output( out ):
+    npy_file, reads_file, n_cols = out
+    n_rows = (npy_file.tell() - NPY_HEADER_LEN) // (4 * n_cols)
+    npy_file.seek(0)
+    write_npy_header(npy_file, n_rows, n_cols)
+    npy_file.close()
+    reads_file.close()
+
+def write_batch( results, lengths, out=None ):
+    if out is None:
+        for (read_id, comp_vector), length in zip(results, lengths):
+            print(format_comp_vector(read_id, length, comp_vector))
     else:
-        with open(fastx) as f:
-            for i, l in enumerate(f):
-                n_lines += 1
-    
+        npy_file, reads_file, n_cols = out
+        matrix = np.asarray([ comp_vector for read_id, comp_vector in results ], dtype=np.float32)
+        npy_file.write(matrix.tobytes())
+        for (read_id, comp_vector), length in zip(results, lengths):
+            reads_file.write("%s\t%i\n" % (read_id.split(" ")[0], length))
+
+def iter_seq_kmers( fastx, ftype, k, threads, funct, count, frac, zipped, batch_size ):
+    """
+    Parse the input once and hand reads to a persistent pool in bounded batches.
+    The next batch is parsed while the previous one is being counted, and
+    (results, lengths) batches are yielded in input order as they complete.
+    """
+    p         = multiprocessing.Pool(processes=threads, initializer=init_kmer_tables, initargs=(k,))
+    chunksize = max(1, batch_size // (threads * 4))
+    try:
+        with open_fastx(fastx, zipped) as fast_file, tqdm(unit=" reads") as progress:
+            reads   = enumerate(iter_fastx(fast_file, ftype))
+            pending = None
+            while True:
+                args    = [ (read_id, seq, read_num, count, frac) for read_num, (read_id, seq) in islice(reads, batch_size) ]
+                running = (p.map_async(funct, args, chunksize), [len(arg[1]) for arg in args]) if args else None
+
+                if pending is not None:
+                    results, lengths = pending
+                    yield results.get(), lengths
+                    progress.update(len(lengths))
+                if running is None:
+                    break
+                pending = running
+        p.close()
+        p.join()
+    except KeyboardInterrupt:
+        p.terminate()
+
+def stream_seq_kmers( fastx, ftype, k, threads, funct, count, frac, zipped, batch_size, out=None ):
+    for results, lengths in iter_seq_kmers( fastx, ftype, k, threads, funct, count, frac, zipped, batch_size ):
+        write_batch(results, lengths, out)
+
+def get_n_reads(fastx, ftype, zipped):
+    with open_fastx(fastx, zipped) as f:
         if ftype=="fastq":
-            n_reads = len([read_tup for read_tup in FastqGeneralIterator(open(fastx))])
-        elif ftype=="fasta":
-            n_reads = len([read_tup for read_tup in SimpleFastaParser(open(fastx))])
-    return n_reads
+            return sum(1 for read_tup in FastqGeneralIterator(f))
+        return sum(1 for read_tup in SimpleFastaParser(f))
 
 def check_input_format(fastx, zipped):
-    if zipped:
-        for line in gzip.open(fastx, mode="rt").readlines():
-            break
-    else:
-        for line in open(fastx).readlines():
-            break
+    with open_fastx(fastx, zipped) as f:
+        line = f.readline()
 
-    try:
-        line[0]
-    except UnboundLocalError:
+    if not line:
         logger.critical("No reads passed the FASTQC for this sample and further analysis will be discontinued")
         sys.exit(72)
 
@@ -249,15 +399,47 @@ def check_input_format(fastx, zipped):
 
 def main(args):
     ftype  = check_input_format(args.qced_reads, args.zipped)
-    n_reads = get_n_reads(args.qced_reads, ftype, args.zipped)
 
-    chunk_n_reads = 5000
+    combined_kmers = init_kmer_tables(args.k)
 
-    all_kmers = build_all_kmers(args.k)
-    combined_kmers = combine_kmers_list(all_kmers)
+    if args.backend=="numpy":
+        funct = calc_seq_kmer_freqs_np
+    else:
+        funct = calc_seq_kmer_freqs
+
+    if args.npy:
+        out = open_npy_output(args.npy, len(combined_kmers))
+        stream_seq_kmers( args.qced_reads,     \
+                          ftype,               \
+                          args.k,              \
+                          args.threads,        \
+                          funct,               \
+                          args.count,          \
+                          args.frac,           \
+                          args.zipped,         \
+                          args.batch_size,     \
+                          out )
+        close_npy_output(out)
+        return
 
     print("read\tlength\t%s" % "\t".join(combined_kmers))
 
+    if args.stream:
+        stream_seq_kmers( args.qced_reads,     \
+                          ftype,               \
+                          args.k,              \
+                          args.threads,        \
+                          funct,               \
+                          args.count,          \
+                          args.frac,           \
+                          args.zipped,         \
+                          args.batch_size )
+        return
+
+    n_reads = args.n_reads if args.n_reads is not None else get_n_reads(args.qced_reads, ftype, args.zipped)
+
+    chunk_n_reads = args.batch_size
+
     read_chunks = list(chunks(range(n_reads), chunk_n_reads))
 
     for chunk in tqdm(read_chunks):
@@ -268,7 +450,7 @@ def main(args):
                                                         args.k,         \
                                                         args.threads,   \
                                                         target_range,   \
-                                                        combined_kmers, \
+                                                        funct,          \
                                                         args.count,     \
                                                         args.frac,      \
                                                         args.zipped )
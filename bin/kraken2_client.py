@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import glob
+import fcntl
+import shutil
+import hashlib
+import argparse
+import logging
+import subprocess
+
+logger = logging.getLogger()
+
+DB_FILES = ["hash.k2d", "opts.k2d", "taxo.k2d"]
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--db", help="kraken2 database directory", type=str, required=True)
+    parser.add_argument("--stage_dir", help="Node-local directory, e.g. /dev/shm, the database is copied to once and shared by all tasks on the node [None]", type=str, default=None)
+    parser.add_argument("--memory_mapping", help="Memory map the database instead of loading it, so tasks on a node share the page cache [False]", action="store_true")
+    parser.add_argument("-t", "--threads", help="Number of kraken2 threads [1]", type=int, default=1)
+    parser.add_argument("--report", help="kraken2 report file", type=str, required=True)
+    parser.add_argument("--output", help="kraken2 per-sequence output file", type=str, required=True)
+    parser.add_argument("query", help="Sequences to classify")
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def db_key(db):
+    """
+    Name of the staged copy of db, changes whenever one of its files does.
+    """
+    stats = []
+    for name in DB_FILES:
+        stat = os.stat(os.path.join(db, name))
+        stats.append("{}:{}:{}".format(name, stat.st_size, int(stat.st_mtime)))
+    digest = hashlib.md5((os.path.abspath(db) + ";" + ";".join(stats)).encode()).hexdigest()[:12]
+    return "kraken2_{}_{}".format(os.path.basename(os.path.normpath(db)), digest)
+
+def stage_db(db, stage_dir):
+    """
+    Copy the database files to stage_dir unless an earlier task on this node
+    already did. Concurrent tasks wait on a lock for the first copy to finish.
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    staged = os.path.join(stage_dir, db_key(db))
+
+    with open(staged + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.isdir(staged):
+            logger.info("Staging kraken2 database {} to {}".format(db, staged))
+            # Remove copies of older versions of the same database
+            for old in glob.glob(os.path.join(stage_dir, "kraken2_{}_*".format(os.path.basename(os.path.normpath(db))))):
+                if os.path.isdir(old) and old != staged:
+                    shutil.rmtree(old, ignore_errors=True)
+            shutil.rmtree(staged + ".tmp", ignore_errors=True)
+            os.makedirs(staged + ".tmp")
+            for name in DB_FILES:
+                shutil.copyfile(os.path.join(db, name), os.path.join(staged + ".tmp", name))
+            os.rename(staged + ".tmp", staged)
+    return staged
+
+def run_kraken2(db, query, report, output, threads, memory_mapping):
+    cmd = ["kraken2", "--db", db, "--threads", str(threads), "--report", report, "--output", output]
+    if memory_mapping:
+        cmd.append("--memory-mapping")
+    subprocess.run(cmd + [query], check=True, stdout=sys.stderr)
+
+def kr_out(report):
+    """
+    Return the report lines of the taxa sequences were assigned to as
+    name;taxid;rank, the KR_OUT format of the classification modules.
+    """
+    lines = []
+    with open(report) as f:
+        for line in f:
+            fields = line.rstrip("\n").replace("\t", ";")
+            fields = re.sub(" +", " ", fields).replace("; ", ";").split(";")
+            if len(fields) < 6 or fields[2].startswith("0"):
+                continue
+            lines.append("{};{};{}".format(fields[5], fields[4], fields[3]))
+    return lines
+
+def main(args):
+    db = args.db
+    if args.stage_dir:
+        db = stage_db(db, args.stage_dir)
+
+    run_kraken2(db, args.query, args.report, args.output, args.threads, args.memory_mapping)
+
+    for line in kr_out(args.report):
+        print(line)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
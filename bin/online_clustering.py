@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import fcntl
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+import umap_hdbscan
+
+logger = logging.getLogger()
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--infile", help="K-mer freqeuency file of a new batch of reads, either a TSV or a .npy matrix with a .reads.tsv sidecar", action="store", dest="kmer_freqs")
+    parser.add_argument("--state_dir", help="Directory holding the persisted model and training reads of this barcode", type=str, required=True)
+    parser.add_argument("--refit_every", help="Refit the model on the training reads every N batches [10]", type=int, default=10)
+    parser.add_argument("--max_training_reads", help="Maximum number of reads kept for refitting, reservoir sampled across batches [100000]", type=int, default=100000)
+    parser.add_argument("-t", "--threads", help="Number of threads used for the HDBSCAN core distances [4]", type=int, default=4)
+    parser.add_argument("--seed", help="Seed of the training read reservoir [42]", type=int, default=42)
+    parser.add_argument("--umap_n_neighbors", help="The size of the local neighborhood UMAP will look at when attempting to learn the manifold structure of the data [15]", type=int, default=15)
+    parser.add_argument("--umap_min_dist", help="The minimum distance apart that points are allowed to be in the low dimensional representation. [0.1]", type=float, default=0.1)
+    parser.add_argument("--umap_pre_reduce", help="Reduce the k-mer matrix with PCA or randomized SVD before UMAP [none]", choices=["none", "pca", "svd"], default="none")
+    parser.add_argument("--umap_pre_dims", help="Number of dimensions kept by the pre-reduction [50]", type=int, default=50)
+    parser.add_argument("--umap_nn_trees", help="Number of random projection trees of the NN-descent kNN search, precomputes the kNN graph [None]", type=int, default=None)
+    parser.add_argument("--umap_nn_iters", help="Number of NN-descent iterations, precomputes the kNN graph [None]", type=int, default=None)
+    parser.add_argument("--umap_high_memory", help="Use the faster, high memory NN-descent of UMAP and pynndescent instead of their low memory default [False]", action="store_true")
+    parser.add_argument("--umap_knn", help="File of a precomputed kNN graph passed to UMAP, computed and written if missing [None]", type=str, default=None)
+    parser.add_argument("--min_samples", help="Measure of how conservative the clustering should be. [None]", type=str, default="n")
+    parser.add_argument("--min_cluster_size", help="Minimum number of reads to call a independent cluster [50]", type=int, default=50)
+    parser.add_argument("--cluster_sel_epsilon", help="Minimun distance to separate clusters. [0.5]", type=float, default=0.5)
+    parser.add_argument("--outfile", help="Output file name [*hdbscan.output]", type=str, default="hdbscan.output")
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def load_state(state_dir):
+    state_file = os.path.join(state_dir, "state.json")
+    if not os.path.exists(state_file):
+        return {"batches": 0, "reads_seen": 0, "model_batch": None}
+    with open(state_file) as f:
+        return json.load(f)
+
+def save_state(state_dir, state):
+    with open(os.path.join(state_dir, "state.json.tmp"), "w") as f:
+        json.dump(state, f)
+    os.replace(os.path.join(state_dir, "state.json.tmp"), os.path.join(state_dir, "state.json"))
+
+def load_training(state_dir):
+    training = os.path.join(state_dir, "training.npy")
+    if not os.path.exists(training):
+        return None, None
+    return umap_hdbscan.load_kmer_freqs(training)
+
+def save_training(state_dir, df, X):
+    np.save(os.path.join(state_dir, "training.tmp.npy"), X)
+    df.to_csv(os.path.join(state_dir, "training.tmp.reads.tsv"), sep="\t", index=False)
+    os.replace(os.path.join(state_dir, "training.tmp.reads.tsv"), os.path.join(state_dir, "training.reads.tsv"))
+    os.replace(os.path.join(state_dir, "training.tmp.npy"), os.path.join(state_dir, "training.npy"))
+
+def update_training(train_df, train_X, df, X, reads_seen, max_reads, rng):
+    """
+    Add a batch to the training reads, keeping a uniform reservoir sample
+    (algorithm R) of at most max_reads reads over all batches seen so far.
+    """
+    if train_X is None:
+        train_df, train_X = df.iloc[:0], np.empty((0, X.shape[1]), dtype=np.float32)
+
+    n_free = max(0, min(max_reads - len(train_X), len(X)))
+    keep_X = np.concatenate([train_X, X[:n_free]]).astype(np.float32)
+    keep_df = pd.concat([train_df, df.iloc[:n_free]], ignore_index=True)
+
+    sources = np.arange(n_free, len(X))
+    slots = rng.integers(0, reads_seen + sources + 1)
+    replaced = slots < max_reads
+    sources, slots = sources[replaced], slots[replaced]
+
+    # A slot drawn by several reads ends up holding the last of them
+    last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+    sources, slots = sources[last], slots[last]
+    keep_X[slots] = X[sources]
+    keep_df.iloc[slots] = df.iloc[sources].to_numpy()
+    return keep_df, keep_X
+
+def main(args):
+    os.makedirs(args.state_dir, exist_ok=True)
+
+    # Batches of the same barcode may be processed concurrently, the state is updated under a lock
+    with open(os.path.join(args.state_dir, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        df, X = umap_hdbscan.load_kmer_freqs(args.kmer_freqs)
+        X = np.asarray(X, dtype=np.float32)
+        if X.shape[0] == 0:
+            logger.critical("No reads in this batch.")
+            sys.exit(73)
+
+        state = load_state(args.state_dir)
+        rng = np.random.default_rng([args.seed, state["batches"]])
+        train_df, train_X = load_training(args.state_dir)
+        train_df, train_X = update_training(train_df, train_X, df, X, state["reads_seen"], args.max_training_reads, rng)
+        save_training(args.state_dir, train_df, train_X)
+
+        state["batches"] += 1
+        state["reads_seen"] += X.shape[0]
+
+        model = umap_hdbscan.load_model(args.state_dir)
+        if model is None or state["batches"] - state["model_batch"] >= args.refit_every:
+            if train_X.shape[0] <= args.umap_n_neighbors:
+                save_state(args.state_dir, state)
+                logger.critical("Only {} reads collected so far, too few to fit the model.".format(train_X.shape[0]))
+                sys.exit(73)
+            logger.info("Refitting the model on {} reads".format(train_X.shape[0]))
+            model = umap_hdbscan.fit_model(train_X, args)
+            umap_hdbscan.save_model(args.state_dir, *model)
+            state["model_batch"] = state["batches"]
+        save_state(args.state_dir, state)
+
+    X_embedded, bin_ids, strengths = umap_hdbscan.predict_model(X, *model)
+
+    umap_out = df.loc[:,["read", "length"]].copy()
+    umap_out["D1"] = X_embedded[:, 0]
+    umap_out["D2"] = X_embedded[:, 1]
+    umap_out["bin_id"] = bin_ids
+    umap_out["probability"] = strengths
+    umap_out["model"] = state["model_batch"]
+    umap_out.to_csv(args.outfile + ".tsv", sep="\t", index=False)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
+    print("online clustering finished")
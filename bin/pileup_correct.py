@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import re
+import sys
+import gzip
+import argparse
+import logging
+import subprocess
+import numpy as np
+from collections import Counter
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
+
+import kmer_freq
+import select_draft
+import subsample_reads
+
+logger = logging.getLogger()
+
+CIGAR = re.compile(r"(\d+)([MIDNSHP=X])")
+COMPLEMENT = str.maketrans("ACGTacgtN", "TGCAtgcaN")
+DELETION = 4
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-r", "--reads", help="Reads of the cluster, fastq, gzipped or not", type=str, required=True)
+    parser.add_argument("-p", "--prefix", help="Prefix of the output, <prefix>.correctedReads.fasta.gz and <prefix>.report", type=str, required=True)
+    parser.add_argument("-t", "--threads", help="Number of minimap2 threads [4]", type=int, default=4)
+    parser.add_argument("--min_coverage", help="Minimum number of reads covering a column to correct it, less covered columns keep the backbone base [2]", type=int, default=2)
+    parser.add_argument("--min_read_length", help="Minimum length of a read to be used and corrected [500]", type=int, default=500)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+def read_fastq(path, min_length):
+    with subsample_reads.open_fastq(path) as fastq:
+        return [(title.split(None, 1)[0], seq) for title, seq, qual in FastqGeneralIterator(fastq) if len(seq) >= min_length]
+
+def align_to_backbone(backbone, reads_fasta, threads):
+    """
+    Return the PAF records of the reads aligned to the backbone, best hit per read.
+    """
+    paf = subprocess.run(["minimap2", "-c", "-x", "map-ont", "--secondary=no", "-t", str(threads), backbone, reads_fasta],
+                         check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    hits = {}
+    for line in paf.splitlines():
+        fields = line.split("\t")
+        cigar = next(tag[5:] for tag in fields[12:] if tag.startswith("cg:Z:"))
+        hit = (fields[0], int(fields[1]), int(fields[2]), int(fields[3]), fields[4], int(fields[7]), int(fields[8]), int(fields[9]), cigar)
+        if fields[0] not in hits or hit[7] > hits[fields[0]][7]:
+            hits[fields[0]] = hit
+    return list(hits.values())
+
+def pileup(hits, reads, length):
+    """
+    Count the bases and deletions of every backbone column, and the sequences
+    inserted after every column.
+    """
+    counts = np.zeros((length, 5), dtype=np.int32)
+    insertions = {}
+    for name, qlen, qstart, qend, strand, tstart, tend, matches, cigar in hits:
+        seq = reads[name]
+        if strand == "-":
+            seq = reverse_complement(seq)
+            qstart, qend = qlen - qend, qlen - qstart
+        codes = kmer_freq.BASE_CODES[np.frombuffer(seq.encode("ascii"), dtype=np.uint8)]
+
+        q, t = qstart, tstart
+        for n, op in CIGAR.findall(cigar):
+            n = int(n)
+            if op in "M=X":
+                bases = codes[q:q + n]
+                valid = bases < 4
+                np.add.at(counts, (np.arange(t, t + n)[valid], bases[valid]), 1)
+                q, t = q + n, t + n
+            elif op == "I":
+                insertions.setdefault(t - 1, Counter())[seq[q:q + n]] += 1
+                q += n
+            elif op in "DN":
+                counts[t:t + n, DELETION] += 1
+                t += n
+    return counts, insertions
+
+def column_vote(backbone_seq, counts, insertions, min_coverage):
+    """
+    Return the consensus of every backbone column including the sequence
+    inserted after it, by majority vote of the reads covering it.
+    """
+    coverage = counts.sum(axis=1)
+    votes = np.where(coverage >= min_coverage, counts.argmax(axis=1), -1)
+
+    columns = []
+    for i, vote in enumerate(votes):
+        column = backbone_seq[i] if vote < 0 else "" if vote == DELETION else "ACGT"[vote]
+        if i in insertions and coverage[i] >= min_coverage:
+            if sum(insertions[i].values()) * 2 > coverage[i]:
+                column += insertions[i].most_common(1)[0][0]
+        columns.append(column)
+    return columns
+
+def pileup_correct(reads_path, prefix, threads=4, min_coverage=2, min_read_length=500):
+    """
+    Correct the reads of a cluster by a column vote over their alignments to
+    the medoid read. Writes <prefix>.correctedReads.fasta.gz with every aligned
+    read replaced by the consensus of the span it covers, in its own orientation,
+    and returns the number of corrected reads.
+    """
+    reads = read_fastq(reads_path, min_read_length)
+    corrected = []
+    if reads:
+        backbone_name, backbone_seq = reads[select_draft.select_medoid(reads)]
+        with open(prefix + ".backbone.fasta", "w") as out:
+            out.write(">{}\n{}\n".format(backbone_name, backbone_seq))
+        with open(prefix + ".reads.fasta", "w") as out:
+            out.write("".join(">{}\n{}\n".format(name, seq) for name, seq in reads))
+
+        hits = align_to_backbone(prefix + ".backbone.fasta", prefix + ".reads.fasta", threads)
+        counts, insertions = pileup(hits, dict(reads), len(backbone_seq))
+        columns = column_vote(backbone_seq, counts, insertions, min_coverage)
+
+        for name, qlen, qstart, qend, strand, tstart, tend, matches, cigar in hits:
+            seq = "".join(columns[tstart:tend])
+            corrected.append((name, reverse_complement(seq) if strand == "-" else seq))
+
+    with gzip.open(prefix + ".correctedReads.fasta.gz", "wt", compresslevel=1) as out:
+        for name, seq in corrected:
+            out.write(">{}\n{}\n".format(name, seq))
+    with open(prefix + ".report", "w") as out:
+        out.write("Found {} reads\nCorrected {} reads\n".format(len(reads), len(corrected)))
+    return len(corrected)
+
+def main(args):
+    n_corrected = pileup_correct(args.reads, args.prefix, args.threads, args.min_coverage, args.min_read_length)
+    if n_corrected == 0:
+        logger.critical("No reads could be corrected.")
+        sys.exit(84)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import gzip
+import shutil
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import select_draft
+import pileup_correct
+
+logger = logging.getLogger()
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--reads", help="Reads of every cluster, fastq", type=str, nargs="+", required=True)
+    parser.add_argument("--logs", help="Log of every cluster", type=str, nargs="+", required=True)
+    parser.add_argument("--clusters", help="Cluster ids, one per reads file", type=str, nargs="+", required=True)
+    parser.add_argument("-p", "--prefix", help="Prefix of the output files, usually the sample id", type=str, required=True)
+    parser.add_argument("-j", "--jobs", help="Number of clusters polished at the same time [1]", type=int, default=1)
+    parser.add_argument("-t", "--threads", help="Number of threads used per cluster [4]", type=int, default=4)
+    parser.add_argument("--polishing_reads", help="Number of reads used for polishing, written to the racon log [100]", type=int, default=100)
+    parser.add_argument("--correction", help="Read correction engine, canu or a minimap2 pileup column vote [canu]", choices=["canu", "pileup"], default="canu")
+    parser.add_argument("--min_coverage", help="Minimum coverage of a column corrected by the pileup engine [2]", type=int, default=2)
+    parser.add_argument("--min_read_length", help="Minimum length of a read corrected by the pileup engine [500]", type=int, default=500)
+    parser.add_argument("--genome_size", help="Canu genomeSize [1.5k]", type=str, default="1.5k")
+    parser.add_argument("--canu_args", help="Additional canu options, e.g. 'minReadLength=500 minOverlapLength=200' [None]", type=str, default="")
+    parser.add_argument("--draft_max_reads", help="Maximum number of reads compared all-vs-all in the draft selection [500]", type=int, default=500)
+    parser.add_argument("--step_timeout", help="Time limit in seconds of the racon and medaka runs of a cluster, exits with 140 when exceeded [3600]", type=int, default=3600)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def count_fasta(path):
+    with gzip.open(path, "rt") as f:
+        return sum(1 for line in f) // 2
+
+def canu_correction(reads, cluster, args):
+    """
+    Run canu -correct on the reads of a cluster, as CANU_CORRECTION does.
+    Returns the gzipped corrected reads or None if canu found no reads.
+    """
+    name = "{}_cluster{}".format(args.prefix, cluster)
+    workdir = name + "_canu"
+    try:
+        subprocess.run(["canu", "-correct", "-p", name, "-d", workdir, "-nanopore", "genomeSize=" + args.genome_size] +
+                       args.canu_args.split() + ["maxThreads={}".format(args.threads), reads], check=True)
+    except subprocess.CalledProcessError as e:
+        logger.warning("Cluster {}: canu exited with {}".format(cluster, e.returncode))
+        return None
+
+    report = os.path.join(workdir, name + ".report")
+    if os.path.exists(report):
+        shutil.copyfile(report, name + ".report")
+        with open(report) as f:
+            if "Found 0 reads" in f.read():
+                return None
+
+    corrected = os.path.join(workdir, name + ".correctedReads.fasta.gz")
+    if not os.path.exists(corrected):
+        return None
+    shutil.move(corrected, name + ".correctedReads.fasta.gz")
+    shutil.rmtree(workdir, ignore_errors=True)
+    return name + ".correctedReads.fasta.gz"
+
+def pileup_correction(reads, cluster, args):
+    """
+    Correct the reads of a cluster with pileup_correct.py, as PILEUP_CORRECTION does.
+    Returns the gzipped corrected reads or None if no read could be corrected.
+    """
+    name = "{}_cluster{}".format(args.prefix, cluster)
+    if pileup_correct.pileup_correct(reads, name, args.threads, args.min_coverage, args.min_read_length) == 0:
+        return None
+    return name + ".correctedReads.fasta.gz"
+
+def racon_pass(draft_read, corrected_reads, cluster, args):
+    """
+    One round of racon on the draft read, as RACON_PASS does. Falls back to
+    the draft read if racon fails or writes nothing.
+    """
+    name = "{}_{}".format(args.prefix, cluster)
+    consensus = name + "_racon_consensus.fasta"
+    subprocess.run(["minimap2", "-ax", "map-ont", "--no-long-join", "-r100", "-t", str(args.threads),
+                    draft_read, corrected_reads, "-o", name + "_aligned.sam"], check=True)
+
+    with open(consensus, "w") as out:
+        racon = subprocess.run(["racon", "--quality-threshold=9", "-w", "250", "-t", str(args.threads),
+                                corrected_reads, name + "_aligned.sam", draft_read], stdout=out, timeout=args.step_timeout)
+
+    success = racon.returncode == 0 and os.path.getsize(consensus) > 0
+    if not success:
+        shutil.copyfile(draft_read, consensus)
+    os.remove(name + "_aligned.sam")
+    return consensus, success
+
+def medaka_pass(draft, corrected_reads, cluster, args):
+    """
+    medaka consensus of the racon consensus, as MEDAKA_PASS does. Falls back
+    to the racon consensus if medaka fails.
+    """
+    outdir = "{}_{}_consensus_medaka".format(args.prefix, cluster)
+    medaka = subprocess.run(["medaka_consensus", "-i", corrected_reads, "-d", draft, "-o", outdir, "-t", str(args.threads)], timeout=args.step_timeout)
+    if medaka.returncode != 0:
+        logger.warning("Cluster {}: medaka failed, taking the racon consensus".format(cluster))
+        os.makedirs(outdir, exist_ok=True)
+        shutil.copyfile(draft, os.path.join(outdir, "consensus.fasta"))
+    return os.path.join(outdir, "consensus.fasta")
+
+def polish_cluster(reads, cluster_log, cluster, args):
+    """
+    Correction, draft selection, racon and medaka for one cluster, writing the
+    files of the per-cluster modules. Returns whether a consensus was made.
+    """
+    if args.correction == "pileup":
+        corrected_reads = pileup_correction(reads, cluster, args)
+    else:
+        corrected_reads = canu_correction(reads, cluster, args)
+    if corrected_reads is None:
+        logger.warning("Cluster {}: read correction has failed and the cluster will be discontinued".format(cluster))
+        return False
+
+    with open(cluster_log) as f:
+        racon_log = "{};{};{};".format(f.read(), args.polishing_reads, count_fasta(corrected_reads))
+    with open("{}_cluster{}_racon.log".format(args.prefix, cluster), "w") as out:
+        out.write(racon_log)
+
+    reads = select_draft.read_fasta(corrected_reads)
+    if not reads:
+        logger.warning("Cluster {}: no corrected reads to select a draft from".format(cluster))
+        return False
+    header, seq = reads[select_draft.select_medoid(reads, max_reads=args.draft_max_reads)]
+    draft_read = "{}_cluster{}_draft_read.fasta".format(args.prefix, cluster)
+    with open(draft_read, "w") as out:
+        out.write(">{}\n{}\n".format(header, seq))
+    with open("{}_{}_draft.log".format(args.prefix, cluster), "w") as out:
+        out.write(racon_log + header.replace(">", ""))
+
+    consensus, success = racon_pass(draft_read, corrected_reads, cluster, args)
+    if not success:
+        logger.warning("Cluster {}: racon correction failed due to not enough overlaps, taking the draft read as consensus".format(cluster))
+    medaka_pass(consensus, corrected_reads, cluster, args)
+    return True
+
+def main(args):
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {cluster: pool.submit(polish_cluster, reads, cluster_log, cluster, args)
+                   for reads, cluster_log, cluster in zip(args.reads, args.logs, args.clusters)}
+        try:
+            polished = [cluster for cluster, future in futures.items() if future.result()]
+        except subprocess.TimeoutExpired as e:
+            # Like the time limit of RACON_PASS and MEDAKA_PASS, the task is retried with a longer limit
+            logger.critical("{} ran longer than {}s".format(e.cmd[0], args.step_timeout))
+            for future in futures.values():
+                future.cancel()
+            sys.exit(140)
+
+    logger.info("Polished {} of {} clusters".format(len(polished), len(futures)))
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import gzip
+import json
+import argparse
+import logging
+from collections import Counter
+
+logger = logging.getLogger()
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-r", "--reads", help="Fastq file, gzipped or not", type=str, required=True)
+    parser.add_argument("-o", "--output", help="Output JSON stats manifest", type=str, required=True)
+    parser.add_argument("--length_bin", help="Bin width of the read length histogram in bp [100]", type=int, default=100)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def mean_quality(qual):
+    return sum(qual.encode("ascii")) / len(qual) - 33 if qual else 0
+
+def new_counts():
+    return {"lengths": Counter(), "qualities": Counter(), "quality_sum": 0.0}
+
+def count_reads(records, counts):
+    """
+    Pass the (title, seq, qual) records through, counting the length and the
+    mean quality of every read on the way.
+    """
+    for record in records:
+        quality = mean_quality(record[2])
+        counts["lengths"][len(record[1])] += 1
+        counts["qualities"][int(quality)] += 1
+        counts["quality_sum"] += quality
+        yield record
+
+def n50(lengths):
+    half = sum(length * n for length, n in lengths.items()) / 2
+    total = 0
+    for length in sorted(lengths, reverse=True):
+        total += length * lengths[length]
+        if total >= half:
+            return length
+    return 0
+
+def summarise(counts, length_bin=100):
+    """
+    Return the stats manifest of the counted reads.
+    """
+    lengths, qualities = counts["lengths"], counts["qualities"]
+    n_reads = sum(lengths.values())
+    n_bases = sum(length * n for length, n in lengths.items())
+    length_histogram = Counter()
+    for length, n in lengths.items():
+        length_histogram[length // length_bin * length_bin] += n
+
+    return {
+        "reads": n_reads,
+        "bases": n_bases,
+        "mean_length": n_bases / n_reads if n_reads else 0,
+        "min_length": min(lengths) if lengths else 0,
+        "max_length": max(lengths) if lengths else 0,
+        "n50": n50(lengths),
+        "mean_quality": counts["quality_sum"] / n_reads if n_reads else 0,
+        "length_histogram": {str(length): length_histogram[length] for length in sorted(length_histogram)},
+        "quality_histogram": {str(q): qualities[q] for q in sorted(qualities)},
+    }
+
+def write_stats(stats, output):
+    with open(output, "w") as out:
+        json.dump(stats, out, indent=2)
+
+def load_stats(path):
+    with open(path) as f:
+        return json.load(f)
+
+def main(args):
+    # Imported here, the counting functions are also used where biopython is not installed
+    from Bio.SeqIO.QualityIO import FastqGeneralIterator
+
+    counts = new_counts()
+    with (gzip.open(args.reads, "rt") if args.reads.endswith(".gz") else open(args.reads)) as fastq:
+        for record in count_reads(FastqGeneralIterator(fastq), counts):
+            pass
+
+    write_stats(summarise(counts, args.length_bin), args.output)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
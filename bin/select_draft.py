@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import sys
+import gzip
+import random
+import argparse
+import logging
+import numpy as np
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+import kmer_freq
+
+logger = logging.getLogger()
+
+# Odd 64-bit constant of the multiplicative k-mer hash
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-r", "--reads", help="Corrected reads of the cluster, fasta, gzipped or not", type=str, required=True)
+    parser.add_argument("-l", "--cluster_log", help="Log of the cluster the read id of the draft is appended to", type=str, required=True)
+    parser.add_argument("-o", "--output", help="Output fasta of the draft read", type=str, required=True)
+    parser.add_argument("--draft_log", help="Output log, the cluster log followed by the read id of the draft", type=str, required=True)
+    parser.add_argument("-k", "--kmer_size", help="k-mer size of the sketches, at most 32 [16]", type=int, default=16)
+    parser.add_argument("-s", "--scale", help="Keep one in SCALE k-mers in the sketches [10]", type=int, default=10)
+    parser.add_argument("-m", "--max_reads", help="Maximum number of reads compared all-vs-all, larger clusters are sampled [500]", type=int, default=500)
+    parser.add_argument("--min_ani", help="Minimum estimated ANI of a pair to count towards the average [80]", type=float, default=80)
+    parser.add_argument("--seed", help="Seed of the read sampling [42]", type=int, default=42)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def read_fasta(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        return list(SimpleFastaParser(f))
+
+def kmer_codes(seq, k):
+    """
+    Return the canonical 2-bit k-mer codes of seq, k-mers containing
+    anything other than ACGT are skipped.
+    """
+    codes = kmer_freq.BASE_CODES[np.frombuffer(seq.encode("ascii"), dtype=np.uint8)]
+    if len(codes) < k:
+        return np.empty(0, dtype=np.uint64)
+
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    valid = (windows < 4).all(axis=1)
+    windows = windows[valid].astype(np.uint64)
+
+    powers = np.uint64(4) ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    forward = windows @ powers
+    reverse = (np.uint64(3) - windows[:, ::-1]) @ powers
+    return np.minimum(forward, reverse)
+
+def sketch(seq, k, scale):
+    """
+    FracMinHash sketch of seq: the distinct k-mer hashes below 2^64 / scale.
+    """
+    hashes = np.unique(kmer_codes(seq, k) * HASH_MULTIPLIER)
+    return hashes[hashes < np.uint64(np.iinfo(np.uint64).max // scale)]
+
+def estimate_ani(sketches, k):
+    """
+    Pairwise ANI estimated from the Jaccard index of the sketches (Mash distance).
+    """
+    sizes = np.array([len(s) for s in sketches], dtype=np.float64)
+    hashes, columns = np.unique(np.concatenate(sketches), return_inverse=True)
+    rows = np.repeat(np.arange(len(sketches)), sizes.astype(int))
+
+    incidence = np.zeros((len(sketches), len(hashes)), dtype=np.float32)
+    incidence[rows, columns] = 1
+    shared = incidence @ incidence.T
+
+    union = sizes[:, None] + sizes[None, :] - shared
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccard = np.where(union > 0, shared / union, 0)
+        ani = 100 * (1 + np.log(2 * jaccard / (1 + jaccard)) / k)
+    return np.nan_to_num(ani, nan=0, neginf=0)
+
+def select_medoid(reads, k=16, scale=10, max_reads=500, min_ani=80, seed=42):
+    """
+    Return the index of the read with the highest average ANI to all reads,
+    pairs below min_ani counting as 0.
+    """
+    candidates = list(range(len(reads)))
+    if len(candidates) > max_reads:
+        candidates = sorted(random.Random(seed).sample(candidates, max_reads))
+        logger.info("Sampled {} of {} reads".format(max_reads, len(reads)))
+
+    sketches = [sketch(reads[i][1], k, scale) for i in candidates]
+    ani = estimate_ani(sketches, k)
+
+    np.fill_diagonal(ani, 100)
+    mean_ani = np.where(ani >= min_ani, ani, 0).mean(axis=1)
+    return candidates[int(np.argmax(mean_ani))]
+
+def main(args):
+    reads = read_fasta(args.reads)
+    if not reads:
+        logger.critical("No corrected reads to select a draft from.")
+        sys.exit(73)
+
+    header, seq = reads[select_medoid(reads, args.kmer_size, args.scale, args.max_reads, args.min_ani, args.seed)]
+
+    with open(args.output, "w") as out:
+        out.write(">{}\n{}\n".format(header, seq))
+
+    with open(args.cluster_log) as f:
+        cluster_log = f.read()
+    with open(args.draft_log, "w") as out:
+        out.write(cluster_log + header.replace(">", ""))
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import re
+import argparse
+import logging
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
+
+import subsample_reads
+
+logger = logging.getLogger()
+
+RUNID = re.compile(r"\srunid.*")
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-r", "--reads", help="Fastq file of the clustered reads, gzipped or not", type=str, required=True)
+    parser.add_argument("-c", "--clusters", help="Clustering output of umap_hdbscan.py, read ids in the first and bin ids in the fifth column", type=str, required=True)
+    parser.add_argument("-m", "--max_reads", help="Maximum number of reads written per cluster, all reads are still counted in the log [None]", type=int, default=None)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def load_clusters(clusters):
+    """
+    Return a dict of read id to bin id of the clustered reads.
+    """
+    read_bins = {}
+    with open(clusters) as f:
+        f.readline()
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 4 and any(c.isdigit() for c in fields[4]):
+                read_bins[fields[0]] = fields[4]
+    return read_bins
+
+def split_reads(reads, read_bins, max_reads):
+    """
+    Write every read of a cluster to <bin_id>.fastq in a single pass over the
+    reads. Returns the number of reads of each cluster.
+    """
+    bin_ids = sorted(set(read_bins.values()))
+    outputs = {bin_id: open(bin_id + ".fastq", "w") for bin_id in bin_ids}
+    counts  = dict.fromkeys(bin_ids, 0)
+
+    with subsample_reads.open_fastq(reads) as fastq:
+        for title, seq, qual in FastqGeneralIterator(fastq):
+            bin_id = read_bins.get(title.split(None, 1)[0])
+            if bin_id is None:
+                continue
+            counts[bin_id] += 1
+            if max_reads is None or counts[bin_id] <= max_reads:
+                outputs[bin_id].write("@%s\n%s\n+\n%s\n" % (RUNID.sub("", title), seq, qual))
+
+    for out in outputs.values():
+        out.close()
+    return counts
+
+def main(args):
+    read_bins = load_clusters(args.clusters)
+    counts = split_reads(args.reads, read_bins, args.max_reads)
+
+    for bin_id, count in counts.items():
+        logger.info("Cluster {}: {} reads".format(bin_id, count))
+        with open(bin_id + ".log", "w") as log:
+            log.write("{};{}".format(bin_id, count))
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import gzip
+import random
+import argparse
+import logging
+from Bio.SeqIO.QualityIO import FastqGeneralIterator
+
+import read_stats
+
+logger = logging.getLogger()
+
+def parse_args():
+    # Create argument parser
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-r", "--reads", help="Fastq file to subsample, gzipped or not", type=str, required=True)
+    parser.add_argument("-o", "--output", help="Output fastq file, gzipped if it ends with .gz", type=str, required=True)
+    parser.add_argument("-n", "--n_reads", help="Number of reads to keep [100000]", type=int, default=100000)
+    parser.add_argument("--method", help="Keep the first n reads or a uniform reservoir sample of the whole file [reservoir]", choices=["head", "reservoir"], default="reservoir")
+    parser.add_argument("--seed", help="Seed of the reservoir sampling [42]", type=int, default=42)
+    parser.add_argument("--stratify", help="Sample proportionally within read length or mean quality strata, reads the input twice: once to count the strata, once to sample [none]", choices=["none", "length", "quality"], default="none")
+    parser.add_argument("--bin_width", help="Width of a stratum in bp (length) or phred units (quality) [100 or 2]", type=float, default=None)
+    parser.add_argument("--compresslevel", help="Gzip compression level of the output [1]", type=int, default=1)
+    parser.add_argument("--stats", help="Write a JSON manifest with the read count, length histogram and quality summary of the input reads and the size of the subset [None]", type=str, default=None)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    return args
+
+def open_fastq(fastq, mode="rt", compresslevel=1):
+    if fastq.endswith(".gz"):
+        if "w" in mode:
+            return gzip.open(fastq, mode, compresslevel=compresslevel)
+        return gzip.open(fastq, mode)
+    return open(fastq, mode)
+
+def get_stratum(record, stratify, bin_width):
+    if stratify == "length":
+        return int(len(record[1]) // bin_width)
+    elif stratify == "quality":
+        return int(read_stats.mean_quality(record[2]) // bin_width)
+    return 0
+
+def count_strata(records, stratify, bin_width):
+    """
+    Number of reads per stratum, the first pass of stratified sampling.
+    """
+    seen = {}
+    for record in records:
+        stratum = get_stratum(record, stratify, bin_width)
+        seen[stratum] = seen.get(stratum, 0) + 1
+    return seen
+
+def reservoir_sample(records, quotas, rng, stratify, bin_width):
+    """
+    Single-pass reservoir sampling (algorithm R), one reservoir per stratum
+    capped at the quota of the stratum. Returns the reservoirs of
+    (read_num, record) and the number of reads seen per stratum.
+    """
+    reservoirs = {}
+    seen = {}
+    for read_num, record in enumerate(records):
+        stratum = get_stratum(record, stratify, bin_width)
+        reservoir = reservoirs.setdefault(stratum, [])
+        seen[stratum] = seen.get(stratum, 0) + 1
+        n_reads = quotas.get(stratum, 0)
+
+        if len(reservoir) < n_reads:
+            reservoir.append((read_num, record))
+        else:
+            j = rng.randrange(seen[stratum])
+            if j < n_reads:
+                reservoir[j] = (read_num, record)
+    return reservoirs, seen
+
+def allocate(seen, n_reads):
+    """
+    Split n_reads across strata proportionally to their size (largest remainder).
+    """
+    total = sum(seen.values())
+    n_reads = min(n_reads, total)
+    shares = {stratum: n_reads * count / total for stratum, count in seen.items()}
+    quotas = {stratum: int(share) for stratum, share in shares.items()}
+    leftover = n_reads - sum(quotas.values())
+    for stratum in sorted(shares, key=lambda s: (quotas[s] - shares[s], s))[:leftover]:
+        quotas[stratum] += 1
+    return quotas
+
+def subsample(records, n_reads, method, seed, stratify, bin_width, strata=None):
+    """
+    Return the sampled records in their original input order. Stratified
+    sampling takes the reads per stratum counted in a first pass, so that
+    no stratum keeps more reads than its share of n_reads.
+    """
+    if method == "head":
+        return [record for read_num, record in zip(range(n_reads), records)]
+
+    rng = random.Random(seed)
+    quotas = allocate(strata, n_reads) if stratify != "none" else {0: n_reads}
+    reservoirs, seen = reservoir_sample(records, quotas, rng, stratify, bin_width)
+
+    sample = [item for stratum in sorted(reservoirs) for item in reservoirs[stratum]]
+    sample.sort(key=lambda item: item[0])
+
+    logger.info("Sampled {} of {} reads from {} strata".format(len(sample), sum(seen.values()), len(seen)))
+    return [record for read_num, record in sample]
+
+def write_fastq(records, output, compresslevel):
+    with open_fastq(output, "wt", compresslevel) as out:
+        for title, seq, qual in records:
+            out.write("@%s\n%s\n+\n%s\n" % (title, seq, qual))
+
+def main(args):
+    if args.bin_width is None:
+        args.bin_width = 2 if args.stratify == "quality" else 100
+
+    strata = None
+    if args.method == "reservoir" and args.stratify != "none":
+        with open_fastq(args.reads) as fastq:
+            strata = count_strata(FastqGeneralIterator(fastq), args.stratify, args.bin_width)
+
+    counts = read_stats.new_counts()
+    with open_fastq(args.reads) as fastq:
+        records = read_stats.count_reads(FastqGeneralIterator(fastq), counts)
+        sample = subsample( records,                     \
+                            args.n_reads,                \
+                            args.method,                 \
+                            args.seed,                   \
+                            args.stratify,               \
+                            args.bin_width,              \
+                            strata )
+
+        # The head stops reading after n reads, the stats cover every read of the input
+        if args.stats:
+            for record in records:
+                pass
+
+    write_fastq(sample, args.output, args.compresslevel)
+
+    if args.stats:
+        stats = read_stats.summarise(counts)
+        stats["subset_reads"] = len(sample)
+        read_stats.write_stats(stats, args.stats)
+
+if __name__=="__main__":
+    args = parse_args()
+
+    main(args)
@@ -5,7 +5,15 @@ import umap
 import matplotlib.pyplot as plt
 import pandas as pd
 import hdbscan
+from hdbscan._hdbscan_tree import condense_tree, compute_stability, get_clusters
+from pynndescent import NNDescent
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.pipeline import Pipeline
 import sys
+import os
+import fcntl
+import shutil
+import joblib
 import argparse
 import logging
 
@@ -15,42 +23,289 @@ def parse_args():
     # Create argument parser
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--infile", help="K-mer freqeuency file", action="store", dest="kmer_freqs")
+    parser.add_argument("--infile", help="K-mer freqeuency file, either a TSV or a .npy matrix with a .reads.tsv sidecar", action="store", dest="kmer_freqs")
+    parser.add_argument("-t", "--threads", help="Number of threads used for the HDBSCAN core distances [4]", type=int, default=4)
+    parser.add_argument("--chunk_size", help="Number of TSV rows parsed at a time into the k-mer matrix [20000]", type=int, default=20000)
     parser.add_argument("--umap_n_neighbors", help="The size of the local neighborhood UMAP will look at when attempting to learn the manifold structure of the data [15]", type=int, default=15)
     parser.add_argument("--umap_min_dist", help="The minimum distance apart that points are allowed to be in the low dimensional representation. [0.1]", type=float, default=0.1)
+    parser.add_argument("--umap_pre_reduce", help="Reduce the k-mer matrix with PCA or randomized SVD before UMAP [none]", choices=["none", "pca", "svd"], default="none")
+    parser.add_argument("--umap_pre_dims", help="Number of dimensions kept by the pre-reduction [50]", type=int, default=50)
+    parser.add_argument("--umap_nn_trees", help="Number of random projection trees of the NN-descent kNN search, precomputes the kNN graph [None]", type=int, default=None)
+    parser.add_argument("--umap_nn_iters", help="Number of NN-descent iterations, precomputes the kNN graph [None]", type=int, default=None)
+    parser.add_argument("--umap_high_memory", help="Use the faster, high memory NN-descent of UMAP and pynndescent instead of their low memory default [False]", action="store_true")
+    parser.add_argument("--umap_knn", help="File of a precomputed kNN graph passed to UMAP, computed and written if missing [None]", type=str, default=None)
     parser.add_argument("--min_samples", help="Measure of how conservative the clustering should be. [None]", type=str, default="n")
     parser.add_argument("--min_cluster_size", help="Minimum number of reads to call a independent cluster [50]", type=int, default=50)
     parser.add_argument("--cluster_sel_epsilon", help="Minimun distance to separate clusters. [0.5]", type=float, default=0.5)
+    parser.add_argument("--sweep_epsilon", help="Also write the clusterings of these cluster selection epsilons, extracted from the same HDBSCAN tree [None]", type=float, nargs="+", default=None)
+    parser.add_argument("--sweep_min_cluster_size", help="Also write the clusterings of these minimum cluster sizes, extracted from the same HDBSCAN tree [None]", type=int, nargs="+", default=None)
     parser.add_argument("--outfile", help="Output file name [*hdbscan.output]", type=str, default="hdbscan.output")
+    parser.add_argument("--model_cache", help="Directory of fitted UMAP/HDBSCAN models reused across samples of the same assay, k and hyperparameters [None]", type=str, default=None)
+    parser.add_argument("--assay", help="Assay of the sample, part of the model cache key [default]", type=str, default="default")
+    parser.add_argument("--model_cache_size", help="Maximum size of the model cache in MB, least recently used models are evicted first [2048]", type=int, default=2048)
 
     # Parse arguments
     args = parser.parse_args()
 
     return args
 
-def main(args):
-    df = pd.read_csv(args.kmer_freqs, delimiter="\t")
+def load_kmer_freqs_tsv(kmer_freqs, chunk_size=20000):
+    """
+    Parse a k-mer frequency TSV chunk by chunk into a preallocated float32
+    matrix, keeping the read ids and lengths in separate arrays.
+    """
+    with open(kmer_freqs) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        n_reads = sum(1 for line in f)
 
-    #UMAP
-    motifs = [x for x in df.columns.values if x not in ["read", "length"]]
-    X = df.loc[:,motifs]
-    X_embedded = umap.UMAP(n_neighbors=int(args.umap_n_neighbors), min_dist=int(args.umap_min_dist), verbose=2).fit_transform(X)
+    motifs   = [x for x in header if x not in ["read", "length"]]
+    dtypes   = dict.fromkeys(motifs, np.float32)
+    dtypes.update({"read": str, "length": np.int64})
+
+    X        = np.empty((n_reads, len(motifs)), dtype=np.float32)
+    read_ids = np.empty(n_reads, dtype=object)
+    lengths  = np.empty(n_reads, dtype=np.int64)
+    n        = 0
+
+    for chunk in pd.read_csv(kmer_freqs, delimiter="\t", dtype=dtypes, chunksize=chunk_size):
+        m = len(chunk)
+        X[n:n+m]        = chunk[motifs].to_numpy()
+        read_ids[n:n+m] = chunk["read"].to_numpy()
+        lengths[n:n+m]  = chunk["length"].to_numpy()
+        n += m
+
+    return pd.DataFrame({"read": read_ids[:n], "length": lengths[:n]}), X[:n]
+
+def load_kmer_freqs(kmer_freqs, chunk_size=20000):
+    """
+    Return the read ids/lengths and the float32 k-mer matrix. A .npy matrix written
+    by kmer_freq.py --npy is memory-mapped instead of being parsed from text.
+    """
+    if kmer_freqs.endswith(".npy"):
+        reads = pd.read_csv(kmer_freqs[:-len(".npy")] + ".reads.tsv", delimiter="\t", dtype={"read": str, "length": np.int64})
+        X = np.load(kmer_freqs, mmap_mode="r")
+        return reads, X
+
+    return load_kmer_freqs_tsv(kmer_freqs, chunk_size)
+
+def build_umap(args, **kwargs):
+    if args.umap_high_memory:
+        kwargs["low_memory"] = False
+    return umap.UMAP(n_neighbors=int(args.umap_n_neighbors), min_dist=int(args.umap_min_dist), verbose=2, **kwargs)
+
+def build_pre_reducer(args, X):
+    if args.umap_pre_reduce == "none":
+        return None
+
+    n_components = min(args.umap_pre_dims, X.shape[1] - 1, X.shape[0] - 1)
+    if n_components < 1:
+        logger.warning("Too few reads or k-mers to pre-reduce, passing the k-mer matrix to UMAP as is.")
+        return None
+
+    if args.umap_pre_reduce == "pca":
+        return PCA(n_components=n_components, svd_solver="randomized")
+    return TruncatedSVD(n_components=n_components, algorithm="randomized")
 
-    df_umap = pd.DataFrame(X_embedded, columns=["D1", "D2"])
-    umap_out = pd.concat([df["read"], df["length"], df_umap], axis=1)
+def build_knn(X, args):
+    """
+    Return the kNN graph of X as (indices, distances, search index) for UMAP's
+    precomputed_knn, or Nones to let UMAP search its own neighbours.
+    """
+    if args.umap_knn is None and args.umap_nn_trees is None and args.umap_nn_iters is None:
+        return None, None, None
 
+    if args.umap_knn and os.path.exists(args.umap_knn):
+        knn = joblib.load(args.umap_knn)
+        if knn[0].shape == (X.shape[0], int(args.umap_n_neighbors)):
+            logger.info("Using the kNN graph in {}".format(args.umap_knn))
+            return knn
+        logger.warning("The kNN graph in {} does not match the k-mer matrix, recomputing it.".format(args.umap_knn))
+
+    nn_kwargs = {"low_memory": False} if args.umap_high_memory else {}
+    index = NNDescent( X,                                         \
+                       n_neighbors=int(args.umap_n_neighbors),    \
+                       n_trees=args.umap_nn_trees,                \
+                       n_iters=args.umap_nn_iters,                \
+                       verbose=True,                              \
+                       **nn_kwargs )
+    knn_indices, knn_dists = index.neighbor_graph
+    knn = (knn_indices, knn_dists, index)
+
+    if args.umap_knn:
+        joblib.dump(knn, args.umap_knn)
+    return knn
+
+def fit_reducer(X, args):
+    """
+    Fit the optional PCA/SVD pre-reduction and UMAP. Returns the reducer, a
+    pipeline of both when pre-reducing, and the embedding of X.
+    """
+    pre_reducer = build_pre_reducer(args, X)
+    if pre_reducer is not None:
+        X = pre_reducer.fit_transform(X).astype(np.float32)
+        logger.info("Pre-reduced the k-mer matrix to {} dimensions".format(X.shape[1]))
+
+    reducer = build_umap(args, precomputed_knn=build_knn(X, args)).fit(X)
+    if pre_reducer is None:
+        return reducer, reducer.embedding_
+    return Pipeline([("pre_reduce", pre_reducer), ("umap", reducer)]), reducer.embedding_
+
+def build_hdbscan(args, **kwargs):
     if args.min_samples == "n":
         min_samp = None
     else:
         min_samp = int(args.min_samples)
 
-    #HDBSCAN
-    X = umap_out.loc[:,["D1", "D2"]]
-    print(X.shape)
+    return hdbscan.HDBSCAN(min_cluster_size=int(args.min_cluster_size), cluster_selection_epsilon=args.cluster_sel_epsilon, min_samples=min_samp, allow_single_cluster=True, core_dist_n_jobs=args.threads, **kwargs)
+
+def sweep_hdbscan(clusterer, epsilons, min_cluster_sizes):
+    """
+    Extract a flat clustering for every epsilon and min_cluster_size from the
+    single linkage tree of a fitted clusterer, condensing it once per
+    min_cluster_size. Returns the bin ids of every setting and the stability
+    of each of their clusters.
+    """
+    single_linkage_tree = clusterer.single_linkage_tree_.to_numpy()
+    bins = {}
+    stabilities = []
+    for min_cluster_size in min_cluster_sizes:
+        condensed_tree = condense_tree(single_linkage_tree, min_cluster_size)
+        stability = compute_stability(condensed_tree)
+        for epsilon in epsilons:
+            labels, probabilities, cluster_stabilities = get_clusters(condensed_tree, dict(stability), "eom", True, False, epsilon)
+            setting = "bin_eps{}_mcs{}".format(epsilon, min_cluster_size)
+            bins[setting] = labels
+            for bin_id, score in enumerate(cluster_stabilities):
+                stabilities.append([setting, epsilon, min_cluster_size, bin_id, np.count_nonzero(labels == bin_id), score])
+
+    stabilities = pd.DataFrame(stabilities, columns=["setting", "epsilon", "min_cluster_size", "bin_id", "reads", "stability"])
+    return pd.DataFrame(bins), stabilities
+
+def fit_model(X, args):
+    """
+    Fit UMAP and an HDBSCAN clusterer that keeps its prediction data, so new
+    reads can later be placed with transform() and approximate_predict().
+    """
+    reducer, X_embedded = fit_reducer(X, args)
+    clusterer = build_hdbscan(args, prediction_data=True).fit(X_embedded)
+    return reducer, clusterer
+
+def save_model(model_dir, reducer, clusterer):
+    os.makedirs(model_dir, exist_ok=True)
+    joblib.dump((reducer, clusterer), os.path.join(model_dir, "model.joblib.tmp"))
+    os.replace(os.path.join(model_dir, "model.joblib.tmp"), os.path.join(model_dir, "model.joblib"))
+
+def load_model(model_dir):
+    model = os.path.join(model_dir, "model.joblib")
+    if not os.path.exists(model):
+        return None
+    return joblib.load(model)
+
+def predict_model(X, reducer, clusterer):
+    """
+    Project X through a fitted model. Returns the embedding, bin ids and membership strengths.
+    """
+    X_embedded = reducer.transform(X)
+    bin_ids, strengths = hdbscan.approximate_predict(clusterer, X_embedded)
+    return X_embedded, bin_ids, strengths
+
+def kmer_size(n_features):
+    """
+    Return the k of a matrix of n_features canonical k-mer columns.
+    """
+    k = 1
+    while (4**k + (4**(k//2) if k % 2 == 0 else 0)) // 2 < n_features:
+        k += 1
+    return k
+
+def model_cache_dir(model_cache, assay, n_features, args):
+    key = "{assay}_k{k}_{pre}{dims}_nn{nn}_md{md}_ms{ms}_mcs{mcs}_eps{eps}".format(
+        assay=assay, k=kmer_size(n_features), pre=args.umap_pre_reduce,
+        dims=args.umap_pre_dims if args.umap_pre_reduce != "none" else "", nn=args.umap_n_neighbors,
+        md=args.umap_min_dist, ms=args.min_samples, mcs=args.min_cluster_size, eps=args.cluster_sel_epsilon)
+    return os.path.join(model_cache, key)
+
+def evict_model_cache(model_cache, max_bytes):
+    """
+    Remove the least recently used models until the cache fits in max_bytes.
+    """
+    models = []
+    for key in os.listdir(model_cache):
+        model = os.path.join(model_cache, key, "model.joblib")
+        if os.path.exists(model):
+            models.append((os.path.getmtime(model), os.path.getsize(model), os.path.join(model_cache, key)))
+
+    total = sum(size for mtime, size, path in models)
+    for mtime, size, path in sorted(models):
+        if total <= max_bytes:
+            break
+        logger.info("Evicting cached model {}".format(path))
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+def cached_model_predict(X, args):
+    """
+    Place X with the cached model of this assay, k and hyperparameters. On a
+    cache miss a model is fitted on X and cached. Returns the embedding and bin ids.
+    """
+    cache_dir = model_cache_dir(args.model_cache, args.assay, X.shape[1], args)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Samples missing the same model at the same time wait for the first one to fit it
+    with open(os.path.join(cache_dir, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        model = load_model(cache_dir)
+        if model is None:
+            reducer, X_embedded = fit_reducer(X, args)
+            clusterer = build_hdbscan(args, prediction_data=True).fit(X_embedded)
+            save_model(cache_dir, reducer, clusterer)
+            evict_model_cache(args.model_cache, args.model_cache_size * 1024**2)
+            return X_embedded, clusterer.labels_
+
+    logger.info("Using cached model {}".format(cache_dir))
+    os.utime(os.path.join(cache_dir, "model.joblib"))
+    X_embedded, bin_ids, strengths = predict_model(X, *model)
+    return X_embedded, bin_ids
+
+def cluster_kmer_freqs(df, X, args):
+    """
+    Embed the k-mer matrix X with UMAP, cluster the embedding with HDBSCAN and
+    write the plot and the clustered reads of df to args.outfile.
+    """
     if X.shape[0] == 1:
         logger.critical("Only one read was provided. HDBSCAN cannot cluster a single point.")
         sys.exit(73)
-    umap_out["bin_id"] = hdbscan.HDBSCAN(min_cluster_size=int(args.min_cluster_size), cluster_selection_epsilon=int(args.cluster_sel_epsilon), min_samples=min_samp, allow_single_cluster=True).fit_predict(X)
+
+    #UMAP
+    bin_ids = None
+    if args.model_cache:
+        X_embedded, bin_ids = cached_model_predict(X, args)
+    else:
+        reducer, X_embedded = fit_reducer(X, args)
+
+    umap_out = pd.DataFrame({ "read":   df["read"].to_numpy(),   \
+                              "length": df["length"].to_numpy(), \
+                              "D1":     X_embedded[:, 0],        \
+                              "D2":     X_embedded[:, 1] })
+
+    #HDBSCAN
+    print(X_embedded.shape)
+    if bin_ids is None:
+        clusterer = build_hdbscan(args).fit(X_embedded)
+        umap_out["bin_id"] = clusterer.labels_
+    else:
+        clusterer = None
+        umap_out["bin_id"] = bin_ids
+
+    if args.sweep_epsilon or args.sweep_min_cluster_size:
+        if clusterer is None:
+            logger.warning("Reads were placed with a cached model, there is no HDBSCAN tree to sweep.")
+        else:
+            sweep, stabilities = sweep_hdbscan( clusterer,                                                         \
+                                                args.sweep_epsilon or [args.cluster_sel_epsilon],                  \
+                                                args.sweep_min_cluster_size or [int(args.min_cluster_size)] )
+            pd.concat([umap_out.loc[:,["read", "length"]], sweep], axis=1).to_csv(args.outfile + "_sweep.tsv", sep="\t", index=False)
+            stabilities.to_csv(args.outfile + "_sweep_stability.tsv", sep="\t", index=False)
 
     #PLOT
     plt.figure(figsize=(20,20))
@@ -69,6 +324,10 @@ def main(args):
     umap_out_clusters = umap_out[umap_out["bin_id"] != -1]
     umap_out_clusters.to_csv(args.outfile + ".tsv", sep="\t", index=False)
 
+def main(args):
+    df, X = load_kmer_freqs(args.kmer_freqs, args.chunk_size)
+    cluster_kmer_freqs(df, X, args)
+
 if __name__=="__main__":
     args = parse_args()
 
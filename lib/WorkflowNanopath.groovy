@@ -14,6 +14,10 @@ class WorkflowNanopath {
     public static void initialise(params, log) {
         genomeExistsError(params, log)
 
+        if (params.kraken2_stage_dir && !params.kraken2_stage_dir.toString().startsWith('/')) {
+            Nextflow.error "The kraken2 stage dir '${params.kraken2_stage_dir}' is not an absolute path. It has to be a host directory shared by the tasks of a node, e.g. '--kraken2_stage_dir /dev/shm/kraken2'."
+        }
+
 
         // if (!params.fasta) {
         //     Nextflow.error "Genome fasta file not specified with e.g. '--fasta genome.fa' or via a detectable config file."
@@ -84,4 +88,11 @@ class WorkflowNanopath {
         def Map json = (Map) new JsonSlurper().parseText(json_file.text).get('summary')
         return json['after_filtering']['total_reads'].toInteger()
     }
+
+    //
+    // Function that parses the read stats manifest written by SUBSET_READS
+    //
+    public static Map getReadStats(json_file) {
+        return (Map) new JsonSlurper().parseText(json_file.text)
+    }
 }
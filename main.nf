@@ -33,13 +33,25 @@ WorkflowMain.initialise(workflow, params, log)
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 */
 
-include { NANOPATH } from './workflows/nanopath'
+include { NANOPATH               } from './workflows/nanopath'
+include { INCREMENTAL_CLUSTERING } from './subworkflows/local/incremental_clustering'
 
 //
 // WORKFLOW: Run main nf-core/nanopath analysis pipeline
 //
 workflow NFCORE_NANOPATH {
-    NANOPATH ()
+    if (params.incremental) {
+        // Cluster FASTQ batches as they are written next to the sequencer, until the run is stopped.
+        // The models persist in a directory outside the task work dirs, mounted into the containers.
+        def state_dir = file(params.incremental_state_dir).toAbsolutePath()
+        state_dir.mkdirs()
+        INCREMENTAL_CLUSTERING (
+            params.fastq_dir,
+            state_dir.toString()
+        )
+    } else {
+        NANOPATH ()
+    }
 }
 
 /*
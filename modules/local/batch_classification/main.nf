@@ -0,0 +1,71 @@
+process BATCH_CLASSIFICATION {
+    tag "$meta.id"
+    label 'process_medium'
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'docker://mbdabrowska1/batch-classification:1.0' :
+        'docker.io/mbdabrowska1/batch-classification:1.0' }"
+
+    input:
+    tuple val(meta), path(consensus, stageAs: 'consensus_*.fasta'), path(cluster_logs), val(clusters)
+
+    output:
+    tuple val(meta), path('*_consensus_classification.csv'),      emit: classification, optional: true
+    tuple val(meta), path('*_classification.log'),                emit: log
+    tuple val(meta), path('*_classification_out.tsv'),            emit: tsv, optional: true
+    path "versions.yml",                                          emit: versions
+
+    script:
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def classification = params.classification
+    def run_kraken2 = classification == "full" || classification == "kraken2"
+    def run_seqmatch = classification == "full" || classification == "seqmatch" || (classification == "kraken2" && params.reclassifyOnFail)
+    def run_blast = classification == "full" || classification == "blast"
+    def kraken2_args = run_kraken2 ? "--kraken2_report ${prefix}_kraken2_consensus_classification.csv --kraken2_output ${prefix}_kraken2_classification_out.tsv" : ""
+    def seqmatch_args = run_seqmatch ? "--seqmatch ${prefix}_seqmatch_out.tsv --seqmatch_accession ${params.seqmatch_accession}" : ""
+    def blast_args = run_blast ? "--blast ${prefix}_blastn_out.csv" : ""
+    def reclassify_args = params.reclassifyOnFail ? "--reclassify_on_fail" : ""
+    def kraken2_client_args = [
+        params.kraken2_memory_mapping ? "--memory_mapping" : "",
+        params.kraken2_stage_dir ? "--stage_dir ${params.kraken2_stage_dir}" : ""
+    ].join(' ').trim()
+
+    """
+    echo "chosen classification: ${classification}, ${clusters.size()} clusters"
+    classify_batch.py concat --clusters ${clusters.join(' ')} --consensus ${consensus.join(' ')} --output ${prefix}_consensus.fasta
+
+    if [ "${run_kraken2}" == "true" ]; then
+        echo "classifying with kraken2"
+        kraken2_client.py --db ${params.kraken2_db} ${kraken2_client_args} --threads $task.cpus --report ${prefix}_kraken2_consensus_classification.csv --output ${prefix}_kraken2_classification_out.tsv ${prefix}_consensus.fasta > /dev/null
+    fi
+
+    if [ "${run_seqmatch}" == "true" ]; then
+        echo "classifying with seqmatch"
+        SequenceMatch seqmatch -k 5 ${params.seqmatch_db} ${prefix}_consensus.fasta > ${prefix}_seqmatch_out.tsv
+    fi
+
+    if [ "${run_blast}" == "true" ]; then
+        echo "classifying with blastn"
+        export BLASTDB=\$(dirname ${params.blast_db})
+        blastn -query ${prefix}_consensus.fasta -db \$(basename ${params.blast_db}) -task megablast -dust no -outfmt '10 qseqid sscinames staxids evalue length pident bitscore' -evalue 11 -max_hsps 50 -max_target_seqs 100 -num_threads $task.cpus > ${prefix}_blastn_out.csv
+    fi
+
+    classify_batch.py split \\
+        --classification ${classification} \\
+        --clusters ${clusters.join(' ')} \\
+        --logs ${cluster_logs.join(' ')} \\
+        --prefix ${prefix} \\
+        $kraken2_args \\
+        $seqmatch_args \\
+        $blast_args \\
+        $reclassify_args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | cut -d ' ' -f2)
+        kraken2: \$(kraken2 --version 2>/dev/null | head -n1 | cut -d' ' -f3)
+        blastn: \$(blastn -version 2>/dev/null | head -n1 | cut -d' ' -f2)
+    END_VERSIONS
+    """
+}
\ No newline at end of file
@@ -1,11 +1,12 @@
 process CAT_FASTQS {
     tag "$fastq_dir"
-    label 'process_single'
+    label 'process_medium'
 
-    conda "bioconda::grep=3.4"
+    // The trim-galore image ships python (through cutadapt) together with pigz
+    conda "bioconda::cutadapt=3.4 bioconda::trim-galore=0.6.7"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
-        'https://depot.galaxyproject.org/singularity/grep:3.4--hf43ccf4_4' :
-        'biocontainers/grep:3.4--hf43ccf4_4' }"
+        'https://depot.galaxyproject.org/singularity/trim-galore:0.6.7--hdfd78af_0' :
+        'biocontainers/trim-galore:0.6.7--hdfd78af_0' }"
 
     input:
     path fastq_dir
@@ -13,30 +14,25 @@ process CAT_FASTQS {
 
     output:
     path "*.fastq.gz",                           emit: fastq
+    path "cat_manifest.tsv",                     emit: manifest
     env NEW_DIR,                                 emit: new_fastq_dir
     path "versions.yml",                         emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     """
-    for i in ${fastq_dir}/barcode*; do
-        barcode=\$(basename \$i)
-        output_file=\$barcode\\.fastq.gz
-    
-        if find \$i -name '*.fastq.gz' -type f -print -quit 2>/dev/null | grep -q '.'; then
-            cat \$i/*.fastq.gz > \$output_file
-        elif find \$i -name '*.fastq' -type f -print -quit 2>/dev/null | grep -q '.'; then
-            cat \$i/*.fastq | gzip -c --best > \$output_file
-        fi
-    done
+    cat_fastqs.py \\
+        --fastq_dir ${fastq_dir} \\
+        --threads $task.cpus \\
+        --manifest cat_manifest.tsv \\
+        $args
     echo "${outdir}"
     NEW_DIR="${outdir}/cat"
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        cat: \$(cat --version | head -n1 | cut -f 4 -d ' ')
-        grep: \$(grep --version | head -n1 | cut -f 4 -d ' ')
-        find: \$(find --version | head -n1 | cut -f 4 -d ' ')
-        gzip: \$(gzip --version | head -n1 | cut -f 2 -d ' ')
+        python: \$(python --version | cut -d ' ' -f2)
+        pigz: \$(command -v pigz > /dev/null && pigz --version 2>&1 | sed 's/pigz //g' || echo 'none, python gzip')
     END_VERSIONS
     """
 
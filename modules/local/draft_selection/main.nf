@@ -4,8 +4,8 @@ process DRAFT_SELECTION {
 
     conda "${moduleDir}/environment.yml"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
-        'docker://quay.io/biocontainers/fastani:1.34--h4dfc31f_1' :
-        'biocontainers/fastani:1.34--h4dfc31f_1' }"
+        'docker://mbdabrowska1/kmer_freqs:1.0' :
+        'docker.io/mbdabrowska1/kmer_freqs:1.0' }"
 
     input:
     tuple val(meta), path(corrected_reads), path(cluster_log), val(cluster)
@@ -15,29 +15,21 @@ process DRAFT_SELECTION {
     path "versions.yml",                                                                                        emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
     def cluster_id = "${cluster}"
-    def frag_length = "${meta.assay}" == "16S" ? 1200 : "${meta.assay}" == "ITS2" ? 400 : 160
     """
-    split -l 2 <(zcat $corrected_reads) split_reads
-    find split_reads* > read_list.txt
-
-    fastANI --ql read_list.txt --rl read_list.txt -o fastani_output.ani -t $task.cpus -k 16 --fragLen ${frag_length}
-
-    DRAFT=\$(awk 'NR>1{name[\$1] = \$1; arr[\$1] += \$3; count[\$1] += 1}  END{for (a in arr) {print arr[a] / count[a], name[a] }}' fastani_output.ani | sort -rg | cut -d " " -f2 | head -n1)
-    cat \$DRAFT > ${prefix}_cluster${cluster_id}_draft_read.fasta
-
-    if [ -s ${prefix}_cluster${cluster_id}_draft_read.fasta ]; then
-        ID=\$(head -n1 ${prefix}_cluster${cluster_id}_draft_read.fasta | sed 's/>//g')
-        cat $cluster_log > ${prefix}_${cluster_id}_draft.log
-        echo -n \$ID >> ${prefix}_${cluster_id}_draft.log
-    else
-        exit 73
-    fi
+    select_draft.py \\
+        --reads $corrected_reads \\
+        --cluster_log $cluster_log \\
+        --output ${prefix}_cluster${cluster_id}_draft_read.fasta \\
+        --draft_log ${prefix}_${cluster_id}_draft.log \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        fastANI: \$(fastANI | head -n1 | cut -f 2 -d ' ')
+        python: \$(python --version | cut -d ' ' -f2)
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
     END_VERSIONS
     """
 
@@ -1,7 +1,7 @@
 process FULL_CLASSIFICATION {
     tag "$meta.id"+ "_" + "$cluster"
 
-    conda "bioconda::kraken2 rdptools blast"
+    conda "conda-forge::python bioconda::kraken2 rdptools blast"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'docker://mbdabrowska1/full-classification:1.0' :
         'docker.io/mbdabrowska1/full-classification:1.0' }"
@@ -19,6 +19,13 @@ process FULL_CLASSIFICATION {
     def prefix = task.ext.prefix ?: "${meta.id}"
     def cluster_id = "${cluster}"
     def kraken2_db = params.kraken2_db
+    def kraken2_report = "${prefix}_${cluster_id}_kraken2_consensus_classification.csv"
+    def kraken2_output = "${prefix}_${cluster_id}_kraken2_classification_out.tsv"
+    // Staging the database needs kraken2_client.py and a container with python, kraken2 is run directly otherwise
+    def kraken2_cmd = params.kraken2_stage_dir ?
+        "KR_OUT=\$(kraken2_client.py --db ${kraken2_db} ${params.kraken2_memory_mapping ? '--memory_mapping' : ''} --stage_dir ${params.kraken2_stage_dir} --report ${kraken2_report} --output ${kraken2_output} $consensus)" :
+        "kraken2 --db ${kraken2_db} ${params.kraken2_memory_mapping ? '--memory-mapping' : ''} --report ${kraken2_report} --output ${kraken2_output} $consensus\n" +
+        "KR_OUT=\$(sed 's/\t/;/g' ${kraken2_report} | tr -s ' ' | sed 's/; /;/g' | cut -d ';' -f3,4,5,6 | grep -v '^0' | awk 'BEGIN {FS=\";\"; OFS=\";\"} {print \$4, \$3, \$2}')"
     def seqmatch_db = params.seqmatch_db
     def seqmatch_accession = params.seqmatch_accession
     def blast_db = params.blast_db
@@ -26,8 +33,7 @@ process FULL_CLASSIFICATION {
     """
     echo "chosen classification: full"
     echo "classifying with kraken2"
-    kraken2 --db ${kraken2_db} --report ${prefix}_${cluster_id}_kraken2_consensus_classification.csv --output ${prefix}_${cluster_id}_kraken2_classification_out.tsv $consensus
-    KR_OUT=\$(sed 's/\t/;/g' ${prefix}_${cluster_id}_kraken2_consensus_classification.csv | tr -s ' ' | sed 's/; /;/g' | cut -d ';' -f3,4,5,6 | grep -v '^0' | awk 'BEGIN {FS=";"; OFS=";"} {print \$4, \$3, \$2}')
+    ${kraken2_cmd}
     
     echo "classifying with seqmatch"
     SequenceMatch seqmatch -k 5 ${seqmatch_db} $consensus | cut -f2,4 | sort | join -t \$'\t' -1 1 -2 1 -o 2.3,2.5,1.2 - ${seqmatch_accession} | sort -k3 -n -r -t '\t' | sed 's/\t/;/g' > ${prefix}_${cluster_id}_seqmatch_consensus_classification.csv
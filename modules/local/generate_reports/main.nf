@@ -8,7 +8,7 @@ process GENERATE_REPORTS {
         'docker.io/mbdabrowska1/generate-reports:1.0' }"
 
     input:
-    tuple val(meta), path(sample_result), path(fastp_results)
+    tuple val(meta), path(sample_result)
     val(positive_control)
     val(negative_control)
     tuple val(kit), val(run_id), val(seq_start)
@@ -26,7 +26,7 @@ process GENERATE_REPORTS {
     def negative="${negative_control}" ? "${negative_control}" : "[None]"
     def positive="${positive_control}" ? "${positive_control}" : "[None]"
     """
-    READS_COUNT=\$(zcat ${fastp_results} | grep 'runid' | wc -l)
+    READS_COUNT=${meta.read_count}
     echo ${negative}
     echo ${positive}
     echo ${meta.id}
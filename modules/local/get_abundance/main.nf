@@ -16,9 +16,10 @@ process GET_ABUNDANCE {
     path "versions.yml",                                          emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
     """
-    get_abundance.py --infile $result_table --prefix ${prefix}
+    get_abundance.py --infile $result_table --prefix ${prefix} $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
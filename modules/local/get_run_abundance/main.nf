@@ -0,0 +1,30 @@
+process GET_RUN_ABUNDANCE {
+    tag "run"
+    label 'process_single'
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'docker://mbdabrowska1/get-abundance:1.0' :
+        'docker.io/mbdabrowska1/get-abundance:1.0' }"
+
+    input:
+    tuple val(sample_ids), path(result_tables)
+
+    output:
+    path('rel_abundance_*_[GSOF].csv'),                           emit: results
+    path('rel_abundance_*_S.csv'),                                emit: species_results
+    path('run_abundance_*.csv'),                                  emit: run_results
+    path "versions.yml",                                          emit: versions
+
+    script:
+    def args = task.ext.args ?: ''
+    """
+    get_abundance.py --run --infile ${result_tables.join(' ')} --prefix ${sample_ids.join(' ')} $args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | cut -d ' ' -f2)
+        pandas: \$(python -c "import pandas; print(pandas.__version__)")
+    END_VERSIONS
+    """
+}
\ No newline at end of file
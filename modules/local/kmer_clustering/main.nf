@@ -0,0 +1,46 @@
+process KMER_CLUSTERING {
+    tag "$meta.id"
+    label (params.throughput == 'high' ? 'high_sensitivity': params.throughput == 'low' ? 'low_resource' : 'standard')
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'docker://mbdabrowska1/kmer-clustering:1.0' :
+        'docker.io/mbdabrowska1/kmer-clustering:1.0' }"
+
+    input:
+    tuple val(meta), path(reads)
+    val umap_set_size
+
+    output:
+    tuple val(meta), path("*_hdbscan_output.tsv"),              emit: clusters
+    path("*_hdbscan_output.png"),                               emit: plot
+    path("*_hdbscan_output_sweep*.tsv"),        optional: true, emit: sweep
+    path "versions.yml",                                        emit: versions
+
+    script:
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def args = task.ext.args ?: ''
+    def zipped = reads.toString().endsWith(".gz") ? '-z' : ''
+
+    """
+    echo "starting k-mer counting and clustering"
+    kmer_clustering.py \\
+        -r $reads \\
+        ${zipped} \\
+        -t $task.cpus \\
+        --max_reads ${umap_set_size} \\
+        --outfile ${prefix}_hdbscan_output \\
+        $args
+    echo "completed clustering"
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version 2>&1 | cut -d' ' -f2)
+        biopython: \$(python -c 'import Bio; print(Bio.__version__)')
+        numpy: \$(python -c 'import numpy; print(numpy.__version__)')
+        umap: \$(python -c "import umap; print(umap.__version__)")
+        hdbscan: \$(python -c "from importlib.metadata import version; print(version('hdbscan'))")
+        pandas: \$(python -c "import pandas; print(pandas.__version__)")
+        matplotlib: \$(python -c "import matplotlib; print(matplotlib.__version__)")
+    END_VERSIONS
+    """
+}
\ No newline at end of file
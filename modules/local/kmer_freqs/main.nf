@@ -10,21 +10,31 @@ process KMER_FREQS {
     tuple val(meta), path(reads)
 
     output:
-    tuple val(meta), path("*_freqs.txt"),        emit: freqs
+    tuple val(meta), path("*_freqs.{txt,npy,reads.tsv}"), emit: freqs
     path "versions.yml",                         emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
     def zipped = reads.toString().endsWith(".gz") ? '-z' : ''
+    def n_reads = meta.subset_reads != null ? "-n ${meta.subset_reads}" : ''
+    def output = params.kmer_freqs_format == 'npy' ? "--npy ${prefix}_freqs" : "> ${prefix}_freqs.txt"
 
     """
     echo ${zipped}
-    kmer_freq.py -r $reads ${zipped} > ${prefix}_freqs.txt
+    kmer_freq.py \\
+        -r $reads \\
+        ${zipped} \\
+        ${n_reads} \\
+        -t $task.cpus \\
+        $args \\
+        $output
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
         python: \$(python --version 2>&1 | cut -d' ' -f2)
         biopython: \$(python -c 'import Bio; print(Bio.__version__)')
+        numpy: \$(python -c 'import numpy; print(numpy.__version__)')
         tqdm: \$(python -c 'import tqdm; print(tqdm.__version__)')
     END_VERSIONS
     """
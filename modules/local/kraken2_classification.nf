@@ -1,7 +1,7 @@
 process KRAKEN2_CLASSIFICATION {
     tag "$meta.id"+ "_" + "$cluster"
 
-    conda "bioconda::kraken2=2.1.3 rdptools=2.0.3"
+    conda "conda-forge::python bioconda::kraken2=2.1.3 rdptools=2.0.3"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://depot.galaxyproject.org/singularity/grep:3.4--hf43ccf4_4' :
         'docker.io/mbdabrowska1/kraken2-classification:1.0' }"
@@ -19,6 +19,13 @@ process KRAKEN2_CLASSIFICATION {
     def prefix = task.ext.prefix ?: "${meta.id}"
     def cluster_id = "${cluster}"
     def kraken2_db = params.kraken2_db
+    def kraken2_report = "${prefix}_${cluster_id}_kraken2_consensus_classification.csv"
+    def kraken2_output = "${prefix}_${cluster_id}_kraken2_classification_out.tsv"
+    // Staging the database needs kraken2_client.py and a container with python, kraken2 is run directly otherwise
+    def kraken2_cmd = params.kraken2_stage_dir ?
+        "KR_OUT=\$(kraken2_client.py --db ${kraken2_db} ${params.kraken2_memory_mapping ? '--memory_mapping' : ''} --stage_dir ${params.kraken2_stage_dir} --report ${kraken2_report} --output ${kraken2_output} $consensus)" :
+        "kraken2 --db ${kraken2_db} ${params.kraken2_memory_mapping ? '--memory-mapping' : ''} --report ${kraken2_report} --output ${kraken2_output} $consensus\n" +
+        "KR_OUT=\$(sed 's/\t/;/g' ${kraken2_report} | tr -s ' ' | sed 's/; /;/g' | cut -d ';' -f3,4,5,6 | grep -v '^0' | awk 'BEGIN {FS=\";\"; OFS=\";\"} {print \$4, \$3, \$2}')"
 
     if(params.reclassifyOnFail){
         seqmatch_accession=params.seqmatch_accession
@@ -26,7 +33,7 @@ process KRAKEN2_CLASSIFICATION {
         """
         echo "chosen classification: kraken2"
         echo "classifying with kraken2"
-        kraken2 --db ${kraken2_db} --report ${prefix}_${cluster_id}_kraken2_consensus_classification.csv --output ${prefix}_${cluster_id}_kraken2_classification_out.tsv $consensus
+        ${kraken2_cmd}
         CLASS_LVL=\$(cut -f4 ${prefix}_${cluster_id}_kraken2_consensus_classification.csv | tail -n1)
         echo \$CLASS_LVL
         if [[ \$CLASS_LVL != "S"* ]]
@@ -41,7 +48,6 @@ process KRAKEN2_CLASSIFICATION {
         else
             cat $cluster_log > ${prefix}_${cluster_id}_classification.log
             echo -n ";" >> ${prefix}_${cluster_id}_classification.log
-            KR_OUT=\$(sed 's/\t/;/g' ${prefix}_${cluster_id}_kraken2_consensus_classification.csv | tr -s ' ' | sed 's/; /;/g' | cut -d ';' -f3,4,5,6 | grep -v '^0' | awk 'BEGIN {FS=";"; OFS=";"} {print \$4, \$3, \$2}')
             echo \$KR_OUT >> ${prefix}_${cluster_id}_classification.log
         fi
 
@@ -54,8 +60,7 @@ process KRAKEN2_CLASSIFICATION {
     else {
         """
         echo "chosen classification: kraken2"
-        kraken2 --db ${kraken2_db} --report ${prefix}_${cluster_id}_kraken2_consensus_classification.csv --output ${prefix}_${cluster_id}_kraken2_classification_out.tsv $consensus
-        KR_OUT=\$(sed 's/\t/;/g' ${prefix}_${cluster_id}_kraken2_consensus_classification.csv | tr -s ' ' | sed 's/; /;/g' | cut -d ';' -f3,4,5,6 | grep -v '^0' | awk 'BEGIN {FS=";"; OFS=";"} {print \$4, \$3, \$2}')
+        ${kraken2_cmd}
         cat $cluster_log > ${prefix}_${cluster_id}_classification.log
         echo -n ";" >> ${prefix}_${cluster_id}_classification.log
         echo \$KR_OUT >> ${prefix}_${cluster_id}_classification.log
@@ -0,0 +1,40 @@
+process ONLINE_CLUSTERING {
+    tag "$meta.id"+ "_" + "$meta.batch"
+    label (params.throughput == 'high' ? 'high_sensitivity': params.throughput == 'low' ? 'low_resource' : 'standard')
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'docker://mbdabrowska1/read-clustering:1.0' :
+        'docker.io/mbdabrowska1/read-clustering:1.0' }"
+
+    input:
+    tuple val(meta), path(freqs)
+    val state_dir
+
+    output:
+    tuple val(meta), path("*_hdbscan_output.tsv"),              emit: clusters
+    path "versions.yml",                                        emit: versions
+
+    script:
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def args = task.ext.args ?: ''
+    // A .npy k-mer matrix arrives together with its .reads.tsv sidecar
+    def infile = freqs.toString().tokenize(' ').find { it.endsWith('.npy') } ?: freqs
+
+    """
+    echo "assigning ${meta.batch} of ${meta.id}"
+    online_clustering.py \\
+        --infile ${infile} \\
+        --state_dir ${state_dir}/${meta.id} \\
+        -t $task.cpus \\
+        --outfile ${prefix}_hdbscan_output \\
+        $args
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | cut -d ' ' -f2)
+        umap: \$(python -c "import umap; print(umap.__version__)")
+        hdbscan: \$(python -c "from importlib.metadata import version; print(version('hdbscan'))")
+        pandas: \$(python -c "import pandas; print(pandas.__version__)")
+    END_VERSIONS
+    """
+}
\ No newline at end of file
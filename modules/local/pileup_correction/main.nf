@@ -0,0 +1,43 @@
+process PILEUP_CORRECTION {
+    tag "$meta.id"+ "_" + "$cluster"
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'docker://mbdabrowska1/pileup-correction:1.0' :
+        'docker.io/mbdabrowska1/pileup-correction:1.0' }"
+
+    input:
+    tuple val(meta), path(reads), path(cluster_log), val(cluster)
+
+    output:
+    tuple val(meta), path("*.report")                                                         , emit: report
+    tuple val(meta), path("*.correctedReads.fasta.gz"), path("*_racon.log"), val(cluster)     , emit: corrected_reads, optional: true
+    path "versions.yml"                                                                       , emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def count = params.polishing_reads
+    def cluster_id = "${cluster}"
+    """
+    pileup_correct.py \\
+        --reads $reads \\
+        --prefix ${prefix}_cluster${cluster_id} \\
+        --threads $task.cpus \\
+        $args
+
+    READ_COUNT=\$(zcat ${prefix}_cluster${cluster_id}.correctedReads.fasta.gz | grep -c '^>')
+    cat $cluster_log > ${prefix}_cluster${cluster_id}_racon.log
+    echo -n ";${count};\$READ_COUNT;" >> ${prefix}_cluster${cluster_id}_racon.log
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        minimap2: \$(minimap2 --version | head -n1)
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+    END_VERSIONS
+    """
+
+}
\ No newline at end of file
@@ -0,0 +1,44 @@
+process POLISH_CLUSTERS {
+    tag "$meta.id"+ "_" + "${clusters.join('_')}"
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'docker://mbdabrowska1/polish-clusters:1.0' :
+        'docker.io/mbdabrowska1/polish-clusters:1.0' }"
+
+    input:
+    tuple val(meta), path(reads), path(cluster_logs), val(clusters)
+
+    output:
+    tuple val(meta), path('*_consensus_medaka/consensus.fasta'), path('*_draft.log'),      emit: consensus, optional: true
+    tuple val(meta), path("*.report"),                                                     emit: report, optional: true
+    tuple val(meta), path("*.correctedReads.fasta.gz"), path("*_racon.log"),               emit: corrected_reads, optional: true
+    tuple val(meta), path('*_draft_read.fasta'),                                           emit: draft, optional: true
+    path "versions.yml",                                                                   emit: versions
+
+    script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    def threads = Math.min(task.cpus as int, 4)
+    def jobs = Math.max(1, (task.cpus as int).intdiv(threads))
+    """
+    polish_clusters.py \\
+        --reads ${reads.join(' ')} \\
+        --logs ${cluster_logs.join(' ')} \\
+        --clusters ${clusters.join(' ')} \\
+        --prefix ${prefix} \\
+        --jobs ${jobs} \\
+        --threads ${threads} \\
+        --polishing_reads ${params.polishing_reads} \\
+        --genome_size ${params.avg_amplicon_size} \\
+        $args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        canu: \$(echo \$(canu --version 2>&1) | sed 's/^.*canu //; s/Using.*\$//' )
+        minimap2: \$(minimap2 --version | head -n1)
+        racon: \$(racon --version | head -n1)
+        medaka: \$(medaka --version)
+    END_VERSIONS
+    """
+}
\ No newline at end of file
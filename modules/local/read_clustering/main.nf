@@ -13,16 +13,20 @@ process READ_CLUSTERING {
     output:
     tuple val(meta), path("*_hdbscan_output.tsv"),              emit: clusters
     path("*_hdbscan_output.png"),                               emit: plot
+    path("*_hdbscan_output_sweep*.tsv"),        optional: true, emit: sweep
     path "versions.yml",                                        emit: versions
 
     script:
     def prefix = task.ext.prefix ?: "${meta.id}"
     def args = task.ext.args ?: ''
+    // A .npy k-mer matrix arrives together with its .reads.tsv sidecar
+    def infile = freqs.toString().tokenize(' ').find { it.endsWith('.npy') } ?: freqs
 
     """
     echo "starting clustering"
     umap_hdbscan.py \\
-        --infile ${freqs} \\
+        --infile ${infile} \\
+        -t $task.cpus \\
         --outfile ${prefix}_hdbscan_output \\
         $args
     echo "completed clustering"
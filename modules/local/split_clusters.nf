@@ -2,10 +2,10 @@ process SPLIT_CLUSTERS {
     tag "$meta.id"
     label 'process_single'
 
-    conda "bioconda::seqtk"
+    conda "conda-forge::python conda-forge::biopython"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
-        'docker://quay.io/biocontainers/seqtk:1.4--he4a0461_1' :
-        'biocontainers/seqtk:1.4--he4a0461_1' }"
+        'docker://mbdabrowska1/kmer_freqs:1.0' :
+        'docker.io/mbdabrowska1/kmer_freqs:1.0' }"
 
     input:
     tuple val(meta), path(reads), path(clusters)
@@ -15,23 +15,20 @@ process SPLIT_CLUSTERS {
     path "versions.yml",                                                             emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     """
-    sed 's/\\srunid.*//g' "$reads" > only_id_header_readfile.fastq
+    split_clusters.py \\
+        -r $reads \\
+        -c $clusters \\
+        $args
 
-    CLUSTERS=\$(awk '(\$5 ~ /[0-9]/) {print \$5}' "$clusters" | sort | uniq)
+    CLUSTERS=\$(ls *.log | sed 's/\\.log\$//' | sort | xargs)
     echo "CLUSTERS: \$CLUSTERS"
 
-    for id in \$CLUSTERS; do
-        echo \$id
-        awk -v cluster="\$id" '(\$5 == cluster) {print \$1}' "$clusters" > cluster_\$id.txt
-        seqtk subseq only_id_header_readfile.fastq -A cluster_\$id.txt > \$id.fastq
-        READ_COUNT=\$(( \$(awk '{print \$1/4}' <(wc -l \$id.fastq)) ))
-        echo -n "\$id;\$READ_COUNT" > \$id.log
-    done
-
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        seqtk: \$(seqtk | head -n1 | cut -f 2 -d ' ')
+        python: \$(python --version 2>&1 | cut -d' ' -f2)
+        biopython: \$(python -c 'import Bio; print(Bio.__version__)')
     END_VERSIONS
     """
 
@@ -2,30 +2,36 @@ process SUBSET_READS {
     tag "$meta.id"
     label 'process_single'
 
-    conda "bioconda::grep=3.4"
+    conda "conda-forge::python conda-forge::biopython"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
-        'https://depot.galaxyproject.org/singularity/grep:3.4--hf43ccf4_4' :
-        'biocontainers/grep:3.4--hf43ccf4_4' }"
+        'docker://mbdabrowska1/kmer_freqs:1.0' :
+        'docker.io/mbdabrowska1/kmer_freqs:1.0' }"
 
     input:
     tuple val(meta), path(reads)
     val umap_set_size
 
     output:
-    tuple val(meta), path("*_subset.fastq.gz"),  emit: subset
-    path "versions.yml",                         emit: versions
+    tuple val(meta), path("*_subset.fastq{,.gz}"), emit: subset
+    tuple val(meta), path("*_read_stats.json"),   emit: stats
+    path "versions.yml",                          emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
+    def suffix = params.subset_compress ? ".fastq.gz" : ".fastq"
     """
-    zcat "$reads" | awk -v lines=\$((${umap_set_size}*4)) 'NR <= lines' > "${prefix}_subset.fastq"
-    gzip "${prefix}_subset.fastq"
-
+    subsample_reads.py \\
+        -r $reads \\
+        -o ${prefix}_subset${suffix} \\
+        -n ${umap_set_size} \\
+        --stats ${prefix}_read_stats.json \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        cat: \$(cat --version | head -n1 | cut -f 4 -d ' ')
-        gzip: \$(gzip --version | head -n1 | cut -f 2 -d ' ')
+        python: \$(python --version 2>&1 | cut -d' ' -f2)
+        biopython: \$(python -c 'import Bio; print(Bio.__version__)')
     END_VERSIONS
     """
 }
\ No newline at end of file
@@ -0,0 +1,17 @@
+process WAIT_FOR_BATCH {
+    tag "$meta.id" + "_" + "$meta.batch"
+
+    input:
+    tuple val(meta), val(fastq)
+    val settle
+
+    output:
+    tuple val(meta), val(fastq), emit: fastq
+
+    // Runs on the local executor, so a batch still being written by MinKNOW
+    // holds a task slot instead of the dataflow thread
+    exec:
+    while (System.currentTimeMillis() - fastq.lastModified() < settle * 1000) {
+        sleep(settle * 1000)
+    }
+}
\ No newline at end of file
@@ -0,0 +1,56 @@
+//
+// Provisional read clustering of a live run, one FASTQ batch at a time
+//
+
+include { WAIT_FOR_BATCH    } from '../../modules/local/wait_for_batch'
+include { KMER_FREQS        } from '../../modules/local/kmer_freqs/main'
+include { ONLINE_CLUSTERING } from '../../modules/local/online_clustering/main'
+
+workflow INCREMENTAL_CLUSTERING {
+    take:
+    fastq_dir // dir: /path/to/fastq_dir with barcodeNN/ subdirectories
+    state_dir // dir: /path/to/state_dir for the persisted models
+
+    main:
+    // Batches already written when the pipeline starts, then every new batch as it lands.
+    // watchPath only watches the directory of its glob, so each barcode directory present
+    // at start is watched on its own; barcode directories created later are not picked up.
+    // A batch written around the start can be both listed and reported as created or
+    // modified, .unique() keeps its first emission so the clustering state sees it once.
+    files("${fastq_dir}/barcode*", type: 'dir')
+        .inject(Channel.fromPath("${fastq_dir}/barcode*/*.{fastq,fastq.gz}")) { ch, barcode_dir ->
+            ch.mix(Channel.watchPath("${barcode_dir}/*.{fastq,fastq.gz}", 'create,modify'))
+        }
+        .unique()
+        .map { create_batch_channel(it) }
+        .set { batches }
+
+    // A batch is only clustered once MinKNOW has finished writing it
+    WAIT_FOR_BATCH (
+        batches,
+        params.incremental_settle_time
+    )
+
+    KMER_FREQS (
+        WAIT_FOR_BATCH.out.fastq
+    )
+
+    ONLINE_CLUSTERING (
+        KMER_FREQS.out.freqs,
+        state_dir
+    )
+
+    emit:
+    clusters = ONLINE_CLUSTERING.out.clusters // channel: [ val(meta), path(tsv) ]
+    versions = KMER_FREQS.out.versions.first().mix(ONLINE_CLUSTERING.out.versions.first()) // channel: [ versions.yml ]
+}
+
+// Function to get [ meta, fastq ] for a FASTQ batch of a barcode
+def create_batch_channel(fastq) {
+    def meta = [:]
+    meta.id         = fastq.parent.name
+    meta.single_end = true
+    meta.batch      = fastq.name.replaceAll(/\.fastq(\.gz)?$/, '')
+
+    return [ meta, fastq ]
+}
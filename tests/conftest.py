@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline scripts import each other from bin/, as they do on the task PATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
@@ -0,0 +1,35 @@
+import pandas as pd
+
+import get_abundance
+
+COLUMNS = ["id", "reads_in_cluster", "used_for_consensus", "reads_after_corr", "draft_id", "classifier_name",
+           "taxid", "stat", "name", "species", "genus", "family", "order"]
+
+
+def write_results(path, clusters):
+    rows = [(i, reads, reads, reads, i, "kraken2", taxid, 1.0, species, species, species.split()[0], family, "order")
+            for i, (reads, taxid, species, family) in enumerate(clusters)]
+    pd.DataFrame(rows, columns=COLUMNS).to_csv(path, sep=";", index=False)
+
+
+def test_run_tables_match_the_sample_tables(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_results("s1.csv", [(10, 562, "Escherichia coli", "Enterobacteriaceae"),
+                             (5, 1396, "Bacillus cereus", "Bacillaceae"),
+                             (5, 562, "Escherichia coli", "Enterobacteriaceae")])
+    write_results("s2.csv", [(6, 1396, "Bacillus cereus", "Bacillaceae"),
+                             (2, 1280, "Staphylococcus aureus", "Staphylococcaceae")])
+
+    get_abundance.get_run_abundance(["s1", "s2"], ["s1.csv", "s2.csv"], ["S", "F"], "rel_abundance", "run_abundance", offline=True)
+
+    reads = pd.read_csv("run_abundance_S_reads.csv", index_col="taxid")
+    assert reads.to_dict("index") == { "Escherichia coli":              {"s1": 15, "s2": 0}, \
+                                       "Bacillus cereus":               {"s1": 5,  "s2": 6}, \
+                                       "Staphylococcus aureus complex": {"s1": 0,  "s2": 2} }
+
+    rel_abundance = pd.read_csv("run_abundance_F_rel_abundance.csv", index_col="taxid")
+    for sample in ["s1", "s2"]:
+        table = pd.read_csv("rel_abundance_" + sample + "_F.csv", index_col="taxid")
+        assert list(table["rel_abundance"]) == sorted(table["rel_abundance"], reverse=True)
+        assert rel_abundance[sample].sum() == 100
+        assert (rel_abundance.loc[table.index, sample] == table["rel_abundance"]).all()
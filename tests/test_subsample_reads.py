@@ -0,0 +1,38 @@
+import argparse
+
+import read_stats
+import subsample_reads
+
+
+def write_reads(path, lengths):
+    with open(path, "w") as out:
+        for i, length in enumerate(lengths):
+            out.write("@read{}\n{}\n+\n{}\n".format(i, "A" * length, "I" * length))
+
+
+def run(tmp_path, lengths, n_reads, method):
+    reads = tmp_path / "reads.fastq"
+    write_reads(reads, lengths)
+    args = argparse.Namespace(reads=str(reads), output=str(tmp_path / "subset.fastq"), n_reads=n_reads,
+                              method=method, seed=42, stratify="none", bin_width=None, compresslevel=1,
+                              stats=str(tmp_path / "stats.json"))
+    subsample_reads.main(args)
+    return read_stats.load_stats(args.stats)
+
+
+def test_head_stats_cover_the_whole_input(tmp_path):
+    lengths = [100 + 10 * i for i in range(50)]
+    stats = run(tmp_path, lengths, 10, "head")
+
+    assert stats["subset_reads"] == 10
+    assert stats["reads"] == 50
+    assert stats["bases"] == sum(lengths)
+    assert stats["max_length"] == max(lengths)
+
+
+def test_reservoir_stats_match_head_stats(tmp_path):
+    lengths = [100 + 10 * i for i in range(50)]
+    head = run(tmp_path, lengths, 10, "head")
+    reservoir = run(tmp_path, lengths, 10, "reservoir")
+
+    assert head == reservoir
@@ -0,0 +1,21 @@
+import argparse
+
+import numpy as np
+
+import umap_hdbscan
+
+
+def blobs(seed=0):
+    rng = np.random.default_rng(seed)
+    centres = [(0, 0), (3, 0), (0, 3), (10, 10)]
+    return np.concatenate([rng.normal(centre, 0.4, size=(60, 2)) for centre in centres]).astype(np.float32)
+
+
+def test_sweep_of_the_main_settings_reproduces_the_main_labels():
+    args = argparse.Namespace(min_samples="n", min_cluster_size=20, cluster_sel_epsilon=1.5, threads=1)
+    clusterer = umap_hdbscan.build_hdbscan(args).fit(blobs())
+    sweep, stabilities = umap_hdbscan.sweep_hdbscan(clusterer, [args.cluster_sel_epsilon], [args.min_cluster_size])
+
+    # An epsilon of 1.5 merges the three close blobs, so it must not be truncated to 1
+    assert len(set(clusterer.labels_) - {-1}) == 2
+    assert np.array_equal(sweep["bin_eps1.5_mcs20"].to_numpy(), clusterer.labels_)
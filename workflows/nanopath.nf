@@ -15,7 +15,7 @@ def checkPathParamList = [ params.input, params.multiqc_config ]
 for (param in checkPathParamList) { if (param) { file(param, checkIfExists: true) } }
 
 // Check mandatory parameters
-if (params.input) { ch_input = file(params.input) } else { exit 1, 'Input samplesheet not specified!' }
+if (params.input) { ch_input = file(params.input) } else if (!params.incremental) { exit 1, 'Input samplesheet not specified!' }
 
 
 if(params.onGridion){
@@ -67,17 +67,22 @@ include { KRAKEN2_KRAKEN2             } from '../modules/nf-core/kraken2/kraken2
 include { SUBSET_READS                } from '../modules/local/subset_reads'
 include { KMER_FREQS                  } from '../modules/local/kmer_freqs/main'
 include { READ_CLUSTERING             } from '../modules/local/read_clustering/main'
+include { KMER_CLUSTERING             } from '../modules/local/kmer_clustering/main'
 include { SPLIT_CLUSTERS              } from '../modules/local/split_clusters'
 include { CANU_CORRECTION             } from '../modules/local/canu_correction/main'
+include { PILEUP_CORRECTION           } from '../modules/local/pileup_correction/main'
 include { DRAFT_SELECTION             } from '../modules/local/draft_selection/main'
 include { RACON_PASS                  } from '../modules/local/racon_pass'
 include { MEDAKA_PASS                 } from '../modules/local/medaka_pass'
+include { POLISH_CLUSTERS             } from '../modules/local/polish_clusters/main'
 include { FULL_CLASSIFICATION         } from '../modules/local/full_classification'
 include { BLAST_CLASSIFICATION        } from '../modules/local/blast_classification'
 include { SEQMATCH_CLASSIFICATION     } from '../modules/local/seqmatch_classification'
 include { KRAKEN2_CLASSIFICATION      } from '../modules/local/kraken2_classification'
+include { BATCH_CLASSIFICATION        } from '../modules/local/batch_classification/main'
 include { JOIN_RESULTS                } from '../modules/local/join_results'
 include { GET_ABUNDANCE               } from '../modules/local/get_abundance/main'
+include { GET_RUN_ABUNDANCE           } from '../modules/local/get_run_abundance/main'
 include { GENERATE_REPORTS            } from '../modules/local/generate_reports/main'
 include { MULTIQC                     } from '../modules/nf-core/multiqc/main'
 include { CUSTOM_DUMPSOFTWAREVERSIONS } from '../modules/nf-core/custom/dumpsoftwareversions/main'
@@ -104,9 +109,11 @@ workflow NANOPATH {
         )
 
         ch_new_fastq_dir=CAT_FASTQS.out.new_fastq_dir
+        ch_cat_manifest = CAT_FASTQS.out.manifest
         ch_versions = ch_versions.mix(CAT_FASTQS.out.versions)
     } else {
         ch_new_fastq_dir = Channel.from([params.fastq_dir])
+        ch_cat_manifest = Channel.empty()
     }
     //
     // SUBWORKFLOW: Read in samplesheet, validate and stage input files
@@ -146,8 +153,10 @@ workflow NANOPATH {
         .join(FASTP.out.json)
         .map {
             meta, reads, json ->
-                if (WorkflowNanopath.getFastpReadsAfterFiltering(json) > 0) {
-                    [meta, reads]
+                def read_count = WorkflowNanopath.getFastpReadsAfterFiltering(json)
+                if (read_count > 0) {
+                    // Carry the read count in meta, so later steps need not recount the reads
+                    [meta + [read_count: read_count], reads]
                 } else {
                     // Add a warning message to the console output
                     log.warn "${meta.id} has been discontinued due to a failed FASTP quality check."
@@ -181,18 +190,35 @@ workflow NANOPATH {
     )
     ch_versions = ch_versions.mix(SUBSET_READS.out.versions.first())
 
-    KMER_FREQS (
-        SUBSET_READS.out.subset
-    )
-    ch_versions = ch_versions.mix(KMER_FREQS.out.versions.first())
+    // Add the subset size from the read stats manifest to meta
+    SUBSET_READS.out.subset
+        .join(SUBSET_READS.out.stats)
+        .map { meta, subset, stats -> [meta + [subset_reads: WorkflowNanopath.getReadStats(stats).subset_reads], subset] }
+        .set { ch_subset }
+
+    if(params.fused_clustering){
+        // Count k-mers and cluster in one process, keeping the k-mer matrix in memory
+        KMER_CLUSTERING (
+            ch_subset,
+            params.umap_set_size
+        )
+        ch_clusters = KMER_CLUSTERING.out.clusters
+        ch_versions = ch_versions.mix(KMER_CLUSTERING.out.versions.first())
+    } else {
+        KMER_FREQS (
+            ch_subset
+        )
+        ch_versions = ch_versions.mix(KMER_FREQS.out.versions.first())
 
-    READ_CLUSTERING (
-        KMER_FREQS.out.freqs,
-    )
-    ch_versions = ch_versions.mix(READ_CLUSTERING.out.versions.first())
+        READ_CLUSTERING (
+            KMER_FREQS.out.freqs,
+        )
+        ch_clusters = READ_CLUSTERING.out.clusters
+        ch_versions = ch_versions.mix(READ_CLUSTERING.out.versions.first())
+    }
 
-    SUBSET_READS.out.subset
-        .join(READ_CLUSTERING.out.clusters, by: [0])
+    ch_subset
+        .join(ch_clusters, by: [0])
         .set{ ch_splitting }
 
     SPLIT_CLUSTERS (
@@ -206,59 +232,96 @@ workflow NANOPATH {
             [meta, reads, log, clusters]
     }.transpose().set {ch_split_cluster}
 
-    CANU_CORRECTION (
-        ch_split_cluster,
-        "-nanopore",
-        params.avg_amplicon_size
-    )
-
-    ch_versions = ch_versions.mix(CANU_CORRECTION.out.versions.first())
+    if(params.batch_polishing){
+        // Polish up to params.polishing_batch_size clusters of a sample in one task
+        POLISH_CLUSTERS (
+            ch_split_cluster
+                .groupTuple(size: params.polishing_batch_size, remainder: true)
+        )
+        ch_versions = ch_versions.mix(POLISH_CLUSTERS.out.versions.first())
+
+        // Split the batches back into one consensus per cluster, matched to its draft log by name
+        ch_consensus = POLISH_CLUSTERS.out.consensus
+            .flatMap {
+                meta, consensus, draft_logs ->
+                    def logs = [draft_logs].flatten().collectEntries { [(it.name - ~/_draft\.log$/): it] }
+                    [consensus].flatten().collect {
+                        def name = it.parent.name - ~/_consensus_medaka$/
+                        [meta, it, logs[name], (name - "${meta.id}_").toInteger()]
+                    }
+            }
+    } else {
+        if(params.correction_engine == "pileup"){
+            PILEUP_CORRECTION (
+                ch_split_cluster
+            )
+            ch_corrected_reads = PILEUP_CORRECTION.out.corrected_reads
+            ch_versions = ch_versions.mix(PILEUP_CORRECTION.out.versions.first())
+        } else {
+            CANU_CORRECTION (
+                ch_split_cluster,
+                "-nanopore",
+                params.avg_amplicon_size
+            )
+            ch_corrected_reads = CANU_CORRECTION.out.corrected_reads
+            ch_versions = ch_versions.mix(CANU_CORRECTION.out.versions.first())
+        }
+
+        DRAFT_SELECTION (
+            ch_corrected_reads
+        )
 
-    DRAFT_SELECTION (
-        CANU_CORRECTION.out.corrected_reads
-    )
+        ch_versions = ch_versions.mix(DRAFT_SELECTION.out.versions.first())
 
-    ch_versions = ch_versions.mix(DRAFT_SELECTION.out.versions.first())
+        RACON_PASS (
+            DRAFT_SELECTION.out.draft
+        )
 
-    RACON_PASS (
-        DRAFT_SELECTION.out.draft
-    )
+        ch_versions = ch_versions.mix(RACON_PASS.out.versions.first())
 
-    ch_versions = ch_versions.mix(RACON_PASS.out.versions.first())
+        // Check for racon success and print warning if success is 0
+        RACON_PASS.out.final_draft.map {
+            meta, draft, log, corrected_reads, cluster_id, success ->
+                if(success == "0"){
+                    log.warn "Sample ${meta.id} : Racon correction for cluster ${cluster_id} failed due to not enough overlaps. Taking draft read as consensus"
+                }
+        }
 
-    // Check for racon success and print warning if success is 0
-    RACON_PASS.out.final_draft.map {
-        meta, draft, log, corrected_reads, cluster_id, success ->
-            if(success == "0"){
-                log.warn "Sample ${meta.id} : Racon correction for cluster ${cluster_id} failed due to not enough overlaps. Taking draft read as consensus"
-            }
-    }
+        MEDAKA_PASS (
+            RACON_PASS.out.final_draft
+        )
 
-    MEDAKA_PASS (
-        RACON_PASS.out.final_draft
-    )
+        ch_versions = ch_versions.mix(MEDAKA_PASS.out.versions.first())
 
-    ch_versions = ch_versions.mix(MEDAKA_PASS.out.versions.first())
+        ch_consensus = MEDAKA_PASS.out.consensus
+    }
 
+    // classify all consensuses of a sample at once if params.batch_classification is set
+    if(params.batch_classification){
+        BATCH_CLASSIFICATION (
+            ch_consensus.groupTuple()
+        )
+        ch_versions = ch_versions.mix(BATCH_CLASSIFICATION.out.versions.first())
+        ch_join_results = BATCH_CLASSIFICATION.out.log
     // run FULL_CLASSIFICATION if params.classification is "full"
-    if(params.classification == "full"){
+    } else if(params.classification == "full"){
         FULL_CLASSIFICATION (
-            MEDAKA_PASS.out.consensus
+            ch_consensus
         )
         ch_join_results = FULL_CLASSIFICATION.out.log.groupTuple()
     } else if(params.classification == "blast"){
         BLAST_CLASSIFICATION (
-            MEDAKA_PASS.out.consensus
+            ch_consensus
         )
         ch_join_results = BLAST_CLASSIFICATION.out.log.groupTuple()
     } else if(params.classification == "seqmatch"){
         SEQMATCH_CLASSIFICATION (
-            MEDAKA_PASS.out.consensus
+            ch_consensus
         )
         ch_join_results = SEQMATCH_CLASSIFICATION.out.log.groupTuple()
     } else {
         KRAKEN2_CLASSIFICATION (
-            MEDAKA_PASS.out.consensus
+            ch_consensus
         )
         ch_join_results = KRAKEN2_CLASSIFICATION.out.log.groupTuple()
     }
@@ -267,9 +330,30 @@ workflow NANOPATH {
         ch_join_results
     )
 
-    GET_ABUNDANCE (
-        JOIN_RESULTS.out.classification
-    )
+    if (params.run_abundance) {
+        // One process for the whole run, the per-sample tables are matched back to their meta by id
+        GET_RUN_ABUNDANCE (
+            JOIN_RESULTS.out.classification
+                .map { meta, result_table -> [meta.id, result_table] }
+                .collect(flat: false)
+                .map { it.transpose() }
+        )
+        ch_versions = ch_versions.mix(GET_RUN_ABUNDANCE.out.versions)
+
+        ch_species_results = JOIN_RESULTS.out.classification
+            .map { meta, result_table -> [meta.id, meta] }
+            .join(
+                GET_RUN_ABUNDANCE.out.species_results
+                    .flatten()
+                    .map { species_results -> [species_results.name - ~/^rel_abundance_/ - ~/_S\.csv$/, species_results] }
+            )
+            .map { id, meta, species_results -> [meta, species_results] }
+    } else {
+        GET_ABUNDANCE (
+            JOIN_RESULTS.out.classification
+        )
+        ch_species_results = GET_ABUNDANCE.out.species_results
+    }
     
     if(!params.onGridion){
         Channel.from(params.kit, 'unknown').set{ch_barcoding_kit}
@@ -277,17 +361,15 @@ workflow NANOPATH {
 
     if(params.clinical && params.generateReports){
 
-        GET_ABUNDANCE.out.species_results.branch{
+        ch_species_results.branch{
             negative: it[0].status == "negative control"
                 return it[1]
             positive: it[0].status == "positive control"
                 return it[1]
         }.set { ch_controls }
 
-        ch_reporting = GET_ABUNDANCE.out.species_results.join(FASTP.out.reads, by: [0])
-
         GENERATE_REPORTS(
-            ch_reporting,
+            ch_species_results,
             ch_controls.positive.toList(),
             ch_controls.negative.toList(),
             ch_meta_final,
@@ -317,6 +399,7 @@ workflow NANOPATH {
     ch_multiqc_files = ch_multiqc_files.mix(ch_methods_description.collectFile(name: 'methods_description_mqc.yaml'))
     ch_multiqc_files = ch_multiqc_files.mix(CUSTOM_DUMPSOFTWAREVERSIONS.out.mqc_yml.collect())
     ch_multiqc_files = ch_multiqc_files.mix(FASTQC.out.zip.collect{it[1]}.ifEmpty([]))
+    ch_multiqc_files = ch_multiqc_files.mix(ch_cat_manifest)
 
     MULTIQC (
         ch_multiqc_files.collect(),